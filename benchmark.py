@@ -0,0 +1,367 @@
+# benchmark.py
+#
+# Scaling benchmarks for pathfinder.Graph on synthetic rail networks
+#
+# python benchmark.py --sizes 10 1000 100000 --output bench_output.txt
+
+
+from typing import Iterator, List
+from collections import defaultdict
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from pathfinder import Graph
+
+"""Seeded generators for directed networks of roughly 'edges' edges,
+one 'SRC,DST,WEIGHT' string per edge (see pathfinder.parseEdge).
+The same seed always gives the same network, so numbers stay comparable
+from one run to the next.
+
+negative=True shifts every weight by h(source) - h(destination) for a
+random potential h per station. Around any cycle the shifts cancel out,
+so plenty of edges turn negative but no negative cycle appears, which
+is what sends Graph to Bellman-Ford
+"""
+
+
+def _spell(edges, seed: int, negative: bool) -> Iterator[str]:
+    rng = random.Random(seed + 1)
+    potential = defaultdict(lambda: rng.randint(0, 10))
+    for source, destination, weight in edges:
+        if negative:
+            weight += potential[source] - potential[destination]
+        yield f"{source},{destination},{weight}"
+
+
+def gridNetwork(
+    edges: int, seed: int = 0, negative: bool = False
+) -> Iterator[str]:
+    """Manhattan style grid, every station links east and south, the
+    last row and column wrap around to the first so trips can return
+    """
+    rng = random.Random(seed)
+    side = max(2, int((edges / 2) ** 0.5))
+
+    def tracks():
+        for row in range(side):
+            for column in range(side):
+                station = f"G{row}x{column}"
+                east = f"G{row}x{(column + 1) % side}"
+                south = f"G{(row + 1) % side}x{column}"
+                yield station, east, rng.randint(1, 9)
+                yield station, south, rng.randint(1, 9)
+
+    return _spell(tracks(), seed, negative)
+
+
+def scaleFreeNetwork(
+    edges: int, seed: int = 0, negative: bool = False
+) -> Iterator[str]:
+    """Preferential attachment, each new station links to 2 existing ones
+    picked in proportion to their degree and one of them links back, a
+    few hubs end up with most of the traffic
+    """
+    rng = random.Random(seed)
+    stations = max(3, edges // 3)
+
+    def tracks():
+        ends = [0, 1, 1, 0]  # every edge end once, sampling it is by degree
+        yield "S0", "S1", 5
+        yield "S1", "S0", 5
+        for station in range(2, stations):
+            picked = {ends[rng.randrange(len(ends))] for _ in range(2)}
+            for hub in picked:
+                yield f"S{station}", f"S{hub}", rng.randint(1, 9)
+                ends.extend([station, hub])
+            back = rng.choice(sorted(picked))
+            yield f"S{back}", f"S{station}", rng.randint(1, 9)
+
+    return _spell(tracks(), seed, negative)
+
+
+def chainNetwork(
+    edges: int, seed: int = 0, negative: bool = False
+) -> Iterator[str]:
+    """One long line with an express hop every 10 stations and a single
+    return track, the worst case for anything that scans |V| times
+    """
+    rng = random.Random(seed)
+    stations = max(2, int(edges / 1.1))
+
+    def tracks():
+        for station in range(stations - 1):
+            yield f"C{station}", f"C{station + 1}", rng.randint(1, 9)
+            if station % 10 == 0 and station + 10 < stations:
+                yield f"C{station}", f"C{station + 10}", rng.randint(30, 90)
+        yield f"C{stations - 1}", "C0", rng.randint(1, 9)
+
+    return _spell(tracks(), seed, negative)
+
+
+GENERATORS = {
+    "grid": gridNetwork,
+    "scale-free": scaleFreeNetwork,
+    "chain": chainNetwork,
+}
+
+
+"""Queries, one callable per public Graph method. The source and
+destination are picked the same way for every generator: the first and
+the last station of the network, or both ends of the first edge for the
+queries that explode with the distance between them. Route generators
+stop at the budget through their deadline. The batches take the ends of
+a few random walks and stay in this process (workers=1), so they time
+the queries rather than the start of a process pool. Precomputations
+drop what they built, the other queries keep running the same engines.
+countAllRoutesWithLimit multiplies dense |V| x |V| matrices, it counts
+modulo a prime to stay in machine integers and is skipped (None) past
+DENSE_MAX_NODES stations: each product is O(|V|^3) and the matrices
+soon stop fitting in memory
+"""
+
+DENSE_MAX_NODES = 500
+
+
+def _randomWalk(graph: Graph, rng: random.Random, hops: int) -> List[str]:
+    node = rng.randrange(len(graph.labels))
+    path = [graph.labels[node]]
+    for _ in range(hops):
+        row = graph.targets[graph.offsets[node]: graph.offsets[node + 1]]
+        if not row:
+            break
+        node = row[rng.randrange(len(row))]
+        path.append(graph.labels[node])
+    return path
+
+
+def _queries(graph: Graph, lines: List[str], seed: int, budget: float):
+    rng = random.Random(seed)
+    source, destination = graph.labels[0], graph.labels[-1]
+    walks = [_randomWalk(graph, rng, 8) for _ in range(1000)]
+    first = lines[0].split(",")
+    origins = [walk[0] for walk in walks[:8]]
+    pairs = [(walk[0], walk[-1]) for walk in walks[:8]]
+    snapshot = os.path.join(
+        tempfile.gettempdir(), f"benchmark-{os.getpid()}.graph"
+    )
+
+    def mutate():
+        graph.addEdge(source, destination, 1)
+        graph.updateWeight(source, destination, 2)
+        graph.removeEdge(source, destination)
+
+    def allPairs():
+        graph.precomputeAllPairs()
+        graph.clearCache()
+
+    def hierarchy():
+        graph.precomputeHierarchy()
+        graph._hierarchy = None  # or the shortest path queries would use it
+
+    def landmarks():
+        graph.precomputeLandmarks()
+        graph._landmarks = None
+
+    def saveLoad():
+        graph.save(snapshot)
+        try:
+            Graph.load(snapshot).findLengthOfShortestPathBetweenTwo(
+                source, destination
+            )
+        finally:
+            os.remove(snapshot)
+            graph._snapshot = None  # the file is gone, batches send rows
+
+    return {
+        "Graph": lambda: Graph(lines),
+        "computeExactPathDistance": lambda: graph.computeExactPathDistance(
+            walks[0]
+        ),
+        "computeExactPathDistances": lambda: graph.computeExactPathDistances(
+            walks
+        ),
+        "findLengthOfShortestPathBetweenTwo": (
+            lambda: graph.findLengthOfShortestPathBetweenTwo(
+                source, destination
+            )
+        ),
+        "findShortestPath": lambda: graph.findShortestPath(
+            source, destination
+        ),
+        "findKShortestPaths": lambda: graph.findKShortestPaths(
+            source, destination, 10
+        ),
+        "shortestDistancesFrom": lambda: graph.shortestDistancesFrom(
+            source
+        ),
+        "shortestDistancesTo": lambda: graph.shortestDistancesTo(
+            destination
+        ),
+        "fewestStopsTo": lambda: graph.fewestStopsTo(destination),
+        "countAllUniquePathsWithLimitByBFS": (
+            lambda: graph.countAllUniquePathsWithLimitByBFS(
+                source, destination, 20, "<="
+            )
+        ),
+        "countRoutesFrom": lambda: graph.countRoutesFrom(source, 20, "<="),
+        "countAllRoutesWithLimit": (
+            (lambda: graph.countAllRoutesWithLimit(20, "<=", 10 ** 6 + 3))
+            if len(graph.labels) <= DENSE_MAX_NODES else None
+        ),
+        "findAllPathsWithLimit": lambda: graph.findAllPathsWithLimit(
+            first[0], first[1], 4, "<="
+        ),
+        "iterRoutesWithLimit": lambda: list(graph.iterRoutesWithLimit(
+            source, destination, 20, "<=", maxResults=1000,
+            deadline=time.monotonic() + budget,
+        )),
+        "countAllUniquePathsBelowWeight": (
+            lambda: graph.countAllUniquePathsBelowWeight(
+                first[0], first[1], 60
+            )
+        ),
+        "iterRoutesBelowWeight": lambda: list(graph.iterRoutesBelowWeight(
+            first[0], first[1], 60, maxResults=1000,
+            deadline=time.monotonic() + budget,
+        )),
+        "precomputeAllPairs": allPairs,
+        "precomputeHierarchy": hierarchy,
+        "precomputeLandmarks": landmarks,
+        "batchShortest": lambda: graph.batchShortest(origins, workers=1),
+        "batchCountRoutes": lambda: graph.batchCountRoutes(
+            pairs, 20, "<=", workers=1
+        ),
+        "save/load": saveLoad,
+        "addEdge/updateWeight/removeEdge": mutate,
+    }
+
+
+"""Timing. A query is repeated until 'repeats' runs or 'budget' seconds,
+whichever comes first, then run once more under tracemalloc for its peak
+memory (tracemalloc slows Python down, so it never overlaps the timings)
+"""
+
+
+def measure(query, repeats: int = 5, budget: float = 2.0) -> dict:
+    timings = []
+    started = time.perf_counter()
+    while len(timings) < repeats:
+        before = time.perf_counter()
+        query()
+        timings.append(time.perf_counter() - before)
+        if time.perf_counter() - started > budget:
+            break
+
+    tracemalloc.start()
+    query()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    median = statistics.median(timings)
+    return {
+        "repeats": len(timings),
+        "median_s": median,
+        "min_s": min(timings),
+        "ops_per_s": 1 / median if median else None,
+        "peak_bytes": peak,
+    }
+
+
+def run(
+    sizes: List[int],
+    generators: List[str],
+    methods: List[str] = None,
+    seed: int = 0,
+    negative: bool = False,
+    repeats: int = 5,
+    budget: float = 2.0,
+) -> Iterator[dict]:
+    """Yield one record per (generator, size, method). A method that blew
+    the budget on one size is recorded as skipped on the larger ones
+    instead of running for hours
+    """
+    for name in generators:
+        tooSlow = set()
+        for size in sorted(sizes):
+            lines = list(GENERATORS[name](size, seed, negative))
+            graph = Graph(lines)
+            queries = _queries(graph, lines, seed, budget)
+            for method, query in queries.items():
+                if methods and method not in methods:
+                    continue
+                record = {
+                    "generator": name,
+                    "negative": negative,
+                    "seed": seed,
+                    "edges": len(graph.targets),
+                    "nodes": len(graph.labels),
+                    "method": method,
+                }
+                if method in tooSlow or query is None:
+                    record["skipped"] = True
+                else:
+                    record.update(measure(query, repeats, budget))
+                    if record["min_s"] > budget:
+                        tooSlow.add(method)
+                yield record
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(
+        description="Scaling benchmarks for pathfinder.Graph"
+    )
+    parser.add_argument(
+        "--sizes", type=int, nargs="+",
+        default=[10, 100, 1000, 10000, 100000, 1000000],
+        help="approximate edge counts",
+    )
+    parser.add_argument(
+        "--generators", nargs="+", choices=sorted(GENERATORS),
+        default=sorted(GENERATORS),
+    )
+    parser.add_argument(
+        "--methods", nargs="+", help="only these Graph methods"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--negative", action="store_true",
+        help="include negative weights (no negative cycles)",
+    )
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument(
+        "--budget", type=float, default=2.0,
+        help="seconds per query before it is skipped on larger sizes",
+    )
+    parser.add_argument(
+        "--output", help="append JSON lines here instead of stdout"
+    )
+    args = parser.parse_args(argv)
+
+    context = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    output = open(args.output, "a") if args.output else sys.stdout
+    try:
+        for record in run(
+            args.sizes, args.generators, args.methods, args.seed,
+            args.negative, args.repeats, args.budget,
+        ):
+            output.write(json.dumps({**context, **record}) + "\n")
+            output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
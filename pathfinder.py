@@ -5,9 +5,34 @@
 # 2019-05-01
 
 
-from typing import List
-from collections import defaultdict, deque
+from typing import Iterable
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial, wraps
+from itertools import islice
+from mmap import ACCESS_READ, mmap as mapFile
+import asyncio
+import heapq
+import logging
 import math
+import os
+import struct
+import sys
+import time
+
+try:
+    import numpy as np
+except ImportError:  # optional, only the dense all-pairs path needs it
+    np = None
+
+try:
+    from numba import njit
+except ImportError:  # optional, compiles the hot loops (see _relaxKernel)
+    njit = None
+
+logger = logging.getLogger(__name__)
 
 """ We wont use this exception but it's here
 for an example where an error can be handled
@@ -16,80 +41,593 @@ for an example where an error can be handled
 """
 
 
+def parseEdge(input: str):
+    """Split one edge into (source, destination, weight).
+
+    Three spellings are understood, labels can be any length in the
+    last two:
+        AB5 or AB500            2 single character labels and a weight
+        SRC,DST,WEIGHT          comma separated, spaces around are fine
+        SRC-DST:WEIGHT          dash between the labels, colon before
+                                the weight
+    Assume weights are integer, negative ones included
+    """
+    if "," in input:
+        fields = input.split(",")
+        if len(fields) != 3:
+            raise ValueError(f"{input!r} is not SRC,DST,WEIGHT")
+        source, destination, weight = (field.strip() for field in fields)
+    elif ":" in input:
+        labels, _, weight = input.rpartition(":")
+        source, _, destination = labels.partition("-")
+    else:
+        source, destination, weight = input[0], input[1], input[2:]
+
+    if not source or not destination:
+        raise ValueError(f"{input!r} is missing a station")
+    return source, destination, int(weight)
+
+
 class Edge:
-    """Assume strict naming convention, 2 single character node labels and a weight
-    example: input = AB5 OR input = AB500
-    Let's ignore the lack of labels and assume we have only A-Z
-    Assume weights are integer
+    """One parsed edge, see parseEdge for the accepted spellings
+    example: input = AB5 OR input = AB500 OR input = Kaitaia,Invercargill,12
     """
 
     def __init__(self, input: str):
-        self.weight = int(input[2:])
-        self.source = input[1]  # superfluous if use Graph._hashify
-        self.destination = input[0]  # superfluous if use Graph._hashify
+        self.source, self.destination, self.weight = parseEdge(input)
+
+
+class NegativeCycleError(str):
+    """What a shortest path query returns instead of distances when a
+    negative cycle is reachable. Still the error string the queries have
+    always returned, with the stations going around the cycle in 'cycle'
+    (the first one repeated at the end)
+    """
+
+    def __new__(cls, cycle: list):
+        error = super().__new__(
+            cls, "NegativeCycleError: " + " -> ".join(cycle)
+        )
+        error.cycle = cycle
+        return error
+
+
+class QueryStats:
+    """What one public Graph query did, handed to Graph.onQuery and logged
+    at debug level. The counters add up over every engine the query ran:
+        relaxations  edges looked at
+        pushes       entries added to a heap, queue or stack
+        expanded     nodes (or search states) taken off it
+        peakQueue    the largest it got
+        peakBytes    memory held by the structures of an enumeration
+        seconds      wall time of the whole query
+    """
+
+    def __init__(self, query: str):
+        self.query = query
+        self.relaxations = 0
+        self.pushes = 0
+        self.expanded = 0
+        self.peakQueue = 0
+        self.peakBytes = 0
+        self.seconds = 0.0
+
+    def __repr__(self):
+        return (
+            f"QueryStats({self.query}: {self.relaxations} relaxations, "
+            f"{self.pushes} pushes, {self.expanded} expanded, "
+            f"peak queue {self.peakQueue}, {self.peakBytes} bytes, "
+            f"{self.seconds:.6f}s)"
+        )
+
+
+def _instrumented(query):
+    """Collect QueryStats for a public query when someone listens, either
+    graph.onQuery or the module logger at debug level. Nobody listening
+    costs one attribute and one level check per call, the engines only
+    report their local counters once at the end
+    """
+
+    @wraps(query)
+    def wrapper(self, *args, **kwargs):
+        if self._stats is not None or (
+            self.onQuery is None and not logger.isEnabledFor(logging.DEBUG)
+        ):
+            # not listened to, or nested in a query already measured
+            return query(self, *args, **kwargs)
+
+        stats = self._stats = QueryStats(query.__name__)
+        started = time.perf_counter()
+        try:
+            return query(self, *args, **kwargs)
+        finally:
+            stats.seconds = time.perf_counter() - started
+            self._stats = None
+            logger.debug("%r", stats)
+            if self.onQuery is not None:
+                self.onQuery(stats)
+
+    return wrapper
+
+
+"""Kernels, the hottest loops written once more over NumPy views of the
+CSR rows, plain integers in, plain integer arrays out, no dicts, no
+tuples, nothing Numba cannot compile. With Numba installed they are
+compiled on first use (and cached next to this file), Graph then calls
+them instead of its pure Python loops whenever Graph.KERNELS is true.
+Without Numba they are never called, the Python loops stay the only
+path. Both give the same answers, the kernels just hand back their
+counters for _record.
+
+int64 has no infinity, KERNEL_INFINITY stands in for an unreached
+node. Walk counts that would pass int64 make _walksKernel give up,
+the caller then counts again in Python ints
+"""
+
+KERNEL_INFINITY = 2 ** 62
+KERNEL_LIMIT = 2 ** 63 - 1
+
+
+def _relaxKernel(offsets, targets, weights, source, parents):
+    """The passes of Graph._bellmanFord, returns the distances, the
+    relaxations, the passes made and the last node relaxed (-1 when
+    the last pass relaxed nothing)
+    """
+    size = len(offsets) - 1
+    distances = np.full(size, KERNEL_INFINITY, np.int64)
+    distances[source] = 0
+    relaxations = passes = 0
+    changed = -1
+    for _ in range(size):
+        passes += 1
+        changed = -1
+        for u in range(size):
+            if distances[u] == KERNEL_INFINITY:
+                continue
+            relaxations += offsets[u + 1] - offsets[u]
+            for index in range(offsets[u], offsets[u + 1]):
+                v = targets[index]
+                if distances[u] + weights[index] < distances[v]:
+                    distances[v] = distances[u] + weights[index]
+                    parents[v] = u
+                    changed = v
+        if changed == -1:
+            break
+    return distances, relaxations, passes, changed
+
+
+def _spfaKernel(offsets, targets, weights, source, parents, within):
+    """The queue of Graph._spfa, a ring of |V| slots since a node is
+    queued once at most, nodes with within[v] == 0 are left out. Returns
+    the distances, relaxations, pushes, expanded, the peak queue and a
+    node on a negative cycle of the parents (-1 when the queue drained)
+    """
+    size = len(offsets) - 1
+    distances = np.full(size, KERNEL_INFINITY, np.int64)
+    distances[source] = 0
+    hops = np.zeros(size, np.int64)
+    queued = np.zeros(size, np.bool_)
+    queue = np.empty(size, np.int64)
+    queue[0] = source
+    queued[source] = True
+    head, length = 0, 1
+    relaxations = pushes = expanded = peak = 0
+    while length:
+        peak = max(peak, length)
+        u = queue[head]
+        head = (head + 1) % size
+        length -= 1
+        queued[u] = False
+        expanded += 1
+        relaxations += offsets[u + 1] - offsets[u]
+        for index in range(offsets[u], offsets[u + 1]):
+            v = targets[index]
+            if not within[v]:
+                continue
+            if distances[u] + weights[index] < distances[v]:
+                distances[v] = distances[u] + weights[index]
+                parents[v] = u
+                hops[v] = hops[u] + 1
+                if hops[v] >= size:
+                    # the walk of Graph._negativeCycle, is v past a cycle
+                    seen = np.zeros(size, np.bool_)
+                    node = v
+                    while node != -1 and not seen[node]:
+                        seen[node] = True
+                        node = parents[node]
+                    if node != -1:
+                        return (
+                            distances, relaxations, pushes, expanded, peak, v
+                        )
+                if not queued[v]:
+                    queued[v] = True
+                    queue[(head + length) % size] = v
+                    length += 1
+                    pushes += 1
+    return distances, relaxations, pushes, expanded, peak, -1
+
+
+def _walksKernel(offsets, targets, source, lowest, highest, hops):
+    """The layers of Graph._countWalksWithLimit, walks of lowest up to
+    highest stops from source ending in each node. The layer is a dense
+    row plus the list of nodes it reached (the keys of the dict in
+    Python). Returns the counts, relaxations, expanded, the peak layer
+    and False when a count would overflow
+    """
+    size = len(offsets) - 1
+    counts = np.zeros(size, np.int64)
+    walks = np.zeros(size, np.int64)
+    following = np.zeros(size, np.int64)
+    frontier = np.empty(size, np.int64)
+    reached = np.empty(size, np.int64)
+    walks[source] = 1
+    frontier[0] = source
+    width = 1
+    relaxations = expanded = peak = 0
+    for stops in range(1, highest + 1):
+        added = 0
+        for position in range(width):
+            current = frontier[position]
+            ways = walks[current]
+            walks[current] = 0  # zeroed for its turn as the next layer
+            relaxations += offsets[current + 1] - offsets[current]
+            for index in range(offsets[current], offsets[current + 1]):
+                v = targets[index]
+                if hops[v] > highest - stops:
+                    continue
+                if following[v] == 0:
+                    reached[added] = v
+                    added += 1
+                if following[v] > KERNEL_LIMIT - ways:
+                    return counts, relaxations, expanded, peak, False
+                following[v] += ways
+        expanded += width
+        walks, following = following, walks
+        frontier, reached = reached, frontier
+        width = added
+        peak = max(peak, width)
+        if stops >= lowest:
+            for position in range(width):
+                node = frontier[position]
+                if counts[node] > KERNEL_LIMIT - walks[node]:
+                    return counts, relaxations, expanded, peak, False
+                counts[node] += walks[node]
+        if width == 0:
+            break
+    return counts, relaxations, expanded, peak, True
+
+
+if njit is not None:
+    _relaxKernel = njit(cache=True, nogil=True)(_relaxKernel)
+    _spfaKernel = njit(cache=True, nogil=True)(_spfaKernel)
+    _walksKernel = njit(cache=True, nogil=True)(_walksKernel)
 
 
 class Graph:
 
     LEGAL_NOTATIONS = ["<", "<=", "=="]
+    SHORTEST_PATH_METHODS = [
+        "dijkstra", "bellman-ford", "spfa", "bidirectional", "alt",
+        "hierarchy",
+    ]
+    ALL_PAIRS_METHODS = ["dijkstra", "johnson", "floyd-warshall"]
+    LANDMARKS = 8  # default count for the ALT heuristic
+    # compiled kernels for the hot loops when Numba is installed, set it
+    # to False (on the class or one graph) for the pure Python loops
+    KERNELS = njit is not None
+    # Bellman-Ford by whole passes of NumPy vector ops when there are no
+    # kernels, False for the loop over one edge at a time
+    VECTORIZED = np is not None
+    # contraction hierarchy witness searches give up after settling this
+    # many nodes, a missed witness only costs a needless shortcut
+    WITNESS_SETTLE_LIMIT = 64
+    # Floyd-Warshall is O(|V|^3) no matter the edge count, NumPy makes the
+    # inner two loops cheap but it only pays off on small dense graphs
+    FLOYD_WARSHALL_MAX_NODES = 512
+    FLOYD_WARSHALL_MIN_DENSITY = 0.25
+    # batched path distances gather from a dense |V| x |V| weight matrix
+    # up to this many nodes (8MB of floats), from the sorted CSR keys above
+    DENSE_GATHER_MAX_NODES = 1024
+    # binary snapshots, see save and load
+    SNAPSHOT_MAGIC = b"PATHFIND"
+    SNAPSHOT_VERSION = 1
+    SNAPSHOT_HEADER = struct.Struct("<8sHcxIQ")  # magic version order flags n
+    SNAPSHOT_SECTION = struct.Struct("<16sQQ")  # name, offset, length
+    SNAPSHOT_ROWS = [
+        "offsets", "targets", "weights",
+        "reverseOffsets", "reverseTargets", "reverseWeights",
+    ]
+    HIERARCHY_ROWS = [
+        "rank", "upOffsets", "upTargets", "upWeights",
+        "downOffsets", "downTargets", "downWeights",
+    ]
+
+    def __init__(
+        self,
+        edges: Iterable[str] = [],
+        cacheSize: int = 0,
+        onQuery=None,
+    ):
+        # node interning, every label gets a dense integer id and all
+        # query methods work on ids, labels only exist at the API boundary
+        self.nodes = {}  # label -> id
+        self.labels = []  # id -> label
+        # compressed sparse row layout, outgoing edges of node u live in
+        # targets[offsets[u]:offsets[u + 1]] (sorted by target id) with
+        # their weights at the same positions in weights
+        self.offsets = array("q", [0])
+        self.targets = array("q")
+        self.weights = array("q")
+        # the same rows for incoming edges, reverseTargets holds sources
+        self.reverseOffsets = array("q", [0])
+        self.reverseTargets = array("q")
+        self.reverseWeights = array("q")
+        self._compile(edges)
+        # Dijkstra is only correct without negative edges, decide once here
+        self.nonNegative = all(w >= 0 for w in self.weights)
+        # query caches, see precomputeAllPairs and _singleSource
+        self.cacheSize = cacheSize
+        self._sourceCache = OrderedDict()  # source id -> distances, LRU
+        self._treeCache = OrderedDict()  # source id -> (distances, parents)
+        self._allPairs = None  # source id -> destination id -> distance
+        self._roundTrips = None  # source id -> shortest way back to it
+        self._landmarks = None  # [(from landmark, to landmark)] for ALT
+        self._hierarchy = None  # HIERARCHY_ROWS, see precomputeHierarchy
+        self._hopIndex = None  # (dense, weights by hop), see _hopWeights
+        # instrumentation, onQuery(QueryStats) after every public query
+        self.onQuery = onQuery
+        self._stats = None  # QueryStats of the query running right now
+        # (path, identity) of the snapshot file the rows are the same as,
+        # see save, load and _sharedSnapshot
+        self._snapshot = None
+
+    """Bulk loading, 'lines' is any iterable of edge strings (see
+    parseEdge), consumed lazily in the same single pass that interns the
+    labels, so a generator over a huge file is never held in memory as
+    strings. Blank lines and lines starting with '#' are skipped
+    """
+
+    @classmethod
+    def fromIterable(cls, lines, **kwargs):
+        edges = (line.strip() for line in lines)
+        return cls(
+            (edge for edge in edges if edge and not edge.startswith("#")),
+            **kwargs,
+        )
+
+    @classmethod
+    def fromFile(cls, path: str, **kwargs):
+        with open(path, encoding="utf-8") as lines:
+            return cls.fromIterable(lines, **kwargs)
+
+    """Binary snapshots, the interned labels and both CSR layouts as
+    they sit in memory, so loading parses nothing:
+
+        header     magic, version, byte order, flags, section count
+        sections   (name, offset, length) for each section below
+        labels     UTF-8 labels separated by NUL
+        rows       offsets, targets, weights and their reverse, 8 byte
+                   aligned machine integers
+        hierarchy  the contraction hierarchy when there is one, same
+                   layout (see precomputeHierarchy)
+
+    Sections are looked up by name, a reader skips the ones it does not
+    know so later versions can add some. A snapshot is written next to
+    the target and renamed over it, a process that mapped the old file
+    keeps reading the old file.
+
+    load(mmap=True) maps the file read-only and the rows are memoryviews
+    straight into it, every worker process that loads the same snapshot
+    shares the same physical pages. The first live change copies the
+    rows into private arrays (copy on write, see _writable). Both remember
+    the identity of the file (device, inode, size, modification time) so
+    a snapshot renamed over it, or its removal, can be told apart
+    """
+
+    def save(self, path: str):
+        sections = [("labels", "\0".join(self.labels).encode("utf-8"))]
+        for name in self.SNAPSHOT_ROWS:
+            sections.append((name, getattr(self, name)))
+        if self._hierarchy is not None:
+            sections += zip(self.HIERARCHY_ROWS, self._hierarchy)
+
+        position = (
+            self.SNAPSHOT_HEADER.size
+            + self.SNAPSHOT_SECTION.size * len(sections)
+        )
+        table = []
+        for name, data in sections:
+            position += -position % 8  # aligned for the integer views
+            table.append((name, position, memoryview(data).nbytes))
+            position += memoryview(data).nbytes
+
+        order = b"<" if sys.byteorder == "little" else b">"
+        with open(path + ".tmp", "wb") as file:
+            file.write(self.SNAPSHOT_HEADER.pack(
+                self.SNAPSHOT_MAGIC, self.SNAPSHOT_VERSION, order,
+                self.nonNegative, len(sections),
+            ))
+            for name, offset, length in table:
+                file.write(self.SNAPSHOT_SECTION.pack(
+                    name.encode("ascii"), offset, length
+                ))
+            for (name, offset, length), (_, data) in zip(table, sections):
+                file.write(bytes(offset - file.tell()))
+                file.write(data)
+        identity = _fileIdentity(os.stat(path + ".tmp"))  # kept by rename
+        os.replace(path + ".tmp", path)
+        self._snapshot = (path, identity)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True, **kwargs):
+        with open(path, "rb") as file:
+            identity = _fileIdentity(os.fstat(file.fileno()))
+            if mmap:
+                buffer = mapFile(file.fileno(), 0, access=ACCESS_READ)
+            else:
+                buffer = file.read()
+        view = memoryview(buffer)
+
+        if view[:8] != cls.SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not a pathfinder snapshot")
+        magic, version, order, flags, count = \
+            cls.SNAPSHOT_HEADER.unpack_from(view)
+        if version > cls.SNAPSHOT_VERSION:
+            raise ValueError(
+                f"{path} is a version {version} snapshot, "
+                f"this pathfinder reads up to {cls.SNAPSHOT_VERSION}"
+            )
+        sections = {}
+        for index in range(count):
+            name, offset, length = cls.SNAPSHOT_SECTION.unpack_from(
+                view,
+                cls.SNAPSHOT_HEADER.size + index * cls.SNAPSHOT_SECTION.size,
+            )
+            sections[name.rstrip(b"\0").decode("ascii")] = \
+                view[offset: offset + length]
+
+        graph = cls(**kwargs)
+        labels = bytes(sections["labels"]).decode("utf-8")
+        graph.labels = labels.split("\0") if labels else []
+        graph.nodes = {label: node for node, label in enumerate(graph.labels)}
+        native = order == (b"<" if sys.byteorder == "little" else b">")
 
-    def __init__(self, edges: List[str] = []):
-        self.edges = edges
-        self.hashTable = defaultdict(Edge)  # avoid key errors
-        self.graph = defaultdict(list)  # avoid key errors
-        self.weightedGraph = []
-        self._hashify()
-        self._graphify()
-        self.nodes = set()
-        self._weightedGraphify()
-        print(self.graph)
+        def integers(name):
+            if mmap and native:
+                return sections[name].cast("q")
+            rows = array("q")
+            rows.frombytes(sections[name])
+            if not native:
+                rows.byteswap()
+            return rows
 
-    """build a hash table to avoid O(N^2) operations, may come in handy
-    It has O(1) average, minor rehash op
-    lets keep it flat and put only weights as values
+        for name in cls.SNAPSHOT_ROWS:
+            setattr(graph, name, integers(name))
+        if all(name in sections for name in cls.HIERARCHY_ROWS):
+            graph._hierarchy = [integers(name) for name in cls.HIERARCHY_ROWS]
+        graph.nonNegative = bool(flags & 1)
+        graph._snapshot = (path, identity)
+        return graph
+
+    def _writable(self):
+        """Copy on write, rows mapped from a snapshot are read-only"""
+        self._snapshot = None  # about to differ from the file
+        for name in self.SNAPSHOT_ROWS:
+            rows = getattr(self, name)
+            if isinstance(rows, memoryview):
+                copy = array("q")
+                copy.frombytes(rows.cast("B"))
+                setattr(self, name, copy)
+
+    def _intern(self, label: str):
+        node = self.nodes.get(label)
+        if node is None:
+            node = self.nodes[label] = len(self.labels)
+            self.labels.append(label)
+        return node
+
+    """One pass over the edges to intern labels into flat arrays, then a sort
+    by (source, target) to lay them out as CSR rows. Per edge we keep three
+    machine integers instead of an Edge object, a dict slot, a list slot
+    and a tuple.
+    A given route never appears twice, if it does the last one wins.
     """
 
-    def _hashify(self):
-        for edge in self.edges:
-            self.hashTable[edge[:2]] = Edge(edge)
+    def _compile(self, edges: Iterable[str]):
+        sources, targets, weights = array("q"), array("q"), array("q")
+        for edge in edges:
+            source, destination, weight = parseEdge(edge)
+            sources.append(self._intern(source))
+            targets.append(self._intern(destination))
+            weights.append(weight)
+
+        size = len(self.labels)
+        order = sorted(
+            range(len(sources)),
+            key=lambda i: sources[i] * size + targets[i],
+        )
+
+        self.offsets = array("q", bytes(8 * (size + 1)))
+        self.targets = array("q")
+        self.weights = array("q")
+        previous = None
+        for i in order:
+            key = (sources[i], targets[i])
+            if key == previous:
+                self.weights[-1] = weights[i]
+                continue
+            previous = key
+            self.offsets[sources[i] + 1] += 1
+            self.targets.append(targets[i])
+            self.weights.append(weights[i])
+
+        for u in range(size):
+            self.offsets[u + 1] += self.offsets[u]
+
+        self._compileReverse()
 
-    """Notes: Some arbitrarily expensive op when adding an edge to existing graph
-    one must also extend the hash table, check edge from self.edges
-    in this task, I would opt out of doing any hash table, but I
-    did question 1 before question 2, and did not optimize. :)
-    So for simplicity, assume this method is private and only accessed
-    in __init__
+    """Transpose of the CSR rows, walking sources in order keeps every
+    reverse row sorted by source
     """
 
-    def _addEdge(self, source, destination):
-        self.graph[source].append(destination)
+    def _compileReverse(self):
+        size = len(self.labels)
+        offsets, targets, weights = self.offsets, self.targets, self.weights
 
-    def _addWeightedEdge(self, source, destination, weight):
-        self.weightedGraph.append((source, destination, weight))
+        self.reverseOffsets = array("q", bytes(8 * (size + 1)))
+        for v in targets:
+            self.reverseOffsets[v + 1] += 1
+        for v in range(size):
+            self.reverseOffsets[v + 1] += self.reverseOffsets[v]
 
-    def _weightedGraphify(self):
-        for edge in self.edges:
-            self.nodes.update(edge[:2])
-            self._addWeightedEdge(edge[0], edge[1], edge[2])
+        self.reverseTargets = array("q", bytes(8 * len(targets)))
+        self.reverseWeights = array("q", bytes(8 * len(targets)))
+        fill = self.reverseOffsets[:-1]
+        for u in range(size):
+            for index in range(offsets[u], offsets[u + 1]):
+                v = targets[index]
+                self.reverseTargets[fill[v]] = u
+                self.reverseWeights[fill[v]] = weights[index]
+                fill[v] += 1
 
-    def _graphify(self):
-        for edge in self.edges:
-            self._addEdge(edge[0], edge[1])
+    def _neighbors(self, node: int):
+        return self.targets[self.offsets[node]: self.offsets[node + 1]]
+
+    def _weight(self, source: int, destination: int):
+        """Binary search in the sorted CSR row, None when there is no edge"""
+        lo, hi = self.offsets[source], self.offsets[source + 1]
+        index = bisect_left(self.targets, destination, lo, hi)
+        if index < hi and self.targets[index] == destination:
+            return self.weights[index]
+        return None
+
+    def _record(
+        self, relaxations=0, pushes=0, expanded=0, peakQueue=0, peakBytes=0
+    ):
+        """Add an engine's counters to the running query, if measured"""
+        stats = self._stats
+        if stats is None:
+            return
+        stats.relaxations += relaxations
+        stats.pushes += pushes
+        stats.expanded += expanded
+        stats.peakQueue = max(stats.peakQueue, peakQueue)
+        stats.peakBytes = max(stats.peakBytes, peakBytes)
 
     """
-    It is asymptotically faster to first build a hash table,
-    avoid an arbitrarily large list search of O(N^2) time,
-    by doing an O(N) operation instead then accessing each edge
-    in a hash table becomes an O(1) operation, which to find
-    the path would be a worst case N time aka O(N)
+    Rows are sorted by target, so finding an edge is a binary search over
+    the out-degree of its source, then each hop of the path costs
+    O(log degree) and the whole path a worst case N of those
 
     Given path, find the exact distance of this fixed path
     """
 
-    def computeExactPathDistance(self, path: str):
-        """To avoid dubious cleanup, lets assume 'path' input
-        have no '-' separators, nevermind about path.replace('-', ''),
-        assume path[0] is source, path[-1] is destination.
+    @_instrumented
+    def computeExactPathDistance(self, path):
+        """'path' is a list of labels, or a string of single character
+        labels with or without '-' separators ('ABC' or 'A-B-C'), or of
+        longer labels with them ('Kaitaia-Invercargill').
+        Assume path[0] is source, path[-1] is destination.
 
         We also assume we want the exact path given in 'path' parameter,
         we're not computing shortest here.
@@ -101,25 +639,136 @@ class Graph:
         if not path:
             return 0
 
+        path = self._splitPath(path)
+
         if len(path) == 2 and path[0] == path[-1]:
             # Assignment says impossible ¯\_(ツ)_/¯
             return "NO SUCH ROUTE"
 
-        # access each path in the hash table, O(N) time of O(1) access ops
-        # get the weight of said edge and move on
+        # look up each hop in its CSR row and move on
         index = 0
         distance = 0
         while index < len(path) - 1:
-            edgeBubble = path[index: index + 2]
-            edge = self.hashTable.get(edgeBubble)
+            source = self.nodes.get(path[index])
+            destination = self.nodes.get(path[index + 1])
+            weight = None
+            if source is not None and destination is not None:
+                weight = self._weight(source, destination)
             # bad path given, distance is irrelevant
-            if not edge:
+            if weight is None:
                 return "NO SUCH ROUTE"
-            distance += edge.weight
+            distance += weight
             index += 1
 
         return distance
 
+    def _splitPath(self, path):
+        if isinstance(path, str):
+            return path.split("-") if "-" in path else list(path)
+        return path
+
+    """Price many routes at once.
+
+    'paths' is a sequence of routes as computeExactPathDistance takes them,
+    or a 2D NumPy array of node ids (see self.nodes), one route per row,
+    shorter routes padded at the end with -1.
+    Returns one distance per route, NaN where there is NO SUCH ROUTE. With
+    NumPy that is a float64 array and every hop of every route is looked
+    up in one vectorised gather, without it an array('d') filled one
+    route at a time
+    """
+
+    @_instrumented
+    def computeExactPathDistances(self, paths):
+        if np is None:
+            distances = array("d")
+            for path in paths:
+                distance = self.computeExactPathDistance(path)
+                if distance == "NO SUCH ROUTE":
+                    distance = math.nan
+                distances.append(distance)
+            return distances
+
+        if isinstance(paths, np.ndarray):
+            routes = np.asarray(paths, dtype=np.int64)
+            if routes.ndim != 2:
+                raise ValueError("expected one route of node ids per row")
+            sources, destinations = routes[:, :-1], routes[:, 1:]
+            hops = (sources >= 0) & (destinations >= 0)  # not padding
+            hopWeights = np.zeros(sources.shape)
+            hopWeights[hops] = self._gatherWeights(
+                sources[hops], destinations[hops]
+            )
+            return hopWeights.sum(axis=1)
+
+        sources, destinations, owners = [], [], []
+        count = 0
+        for route, path in enumerate(paths):
+            count += 1
+            path = [
+                self.nodes.get(label, -1) for label in self._splitPath(path)
+            ]
+            sources.extend(path[:-1])
+            destinations.extend(path[1:])
+            owners.extend([route] * max(len(path) - 1, 0))
+
+        hopWeights = self._gatherWeights(
+            np.array(sources, dtype=np.int64),
+            np.array(destinations, dtype=np.int64),
+        )
+        # NaN hops make their whole route NaN
+        return np.bincount(
+            np.array(owners, dtype=np.int64),
+            weights=hopWeights,
+            minlength=count,
+        )
+
+    def _gatherWeights(self, sources, destinations):
+        """Weight of every (source, destination) hop, NaN when missing"""
+        size = len(self.labels)
+        hopWeights = np.full(len(sources), np.nan)
+        known = (sources >= 0) & (sources < size) & \
+                (destinations >= 0) & (destinations < size)
+        if not len(self.targets) or not known.any():
+            return hopWeights
+        sources, destinations = sources[known], destinations[known]
+
+        if size <= self.DENSE_GATHER_MAX_NODES:
+            matrix = self._hopWeights(dense=True)
+            hopWeights[known] = matrix[sources, destinations]
+            return hopWeights
+
+        keys, weights = self._hopWeights(dense=False)
+        wanted = sources * size + destinations
+        position = np.minimum(np.searchsorted(keys, wanted), len(keys) - 1)
+        hopWeights[known] = np.where(
+            keys[position] == wanted, weights[position], np.nan
+        )
+        return hopWeights
+
+    def _hopWeights(self, dense):
+        """What _gatherWeights looks hops up in, built on the first batch
+        and kept until the network changes: the dense weight matrix, or
+        the sorted source * |V| + target keys of the CSR (rows are sorted
+        by source and each row by target, they are in order already)
+        with their weights
+        """
+        if self._hopIndex is not None and self._hopIndex[0] == dense:
+            return self._hopIndex[1]
+        size = len(self.labels)
+        offsets = np.frombuffer(self.offsets, dtype=np.int64)
+        targets = np.frombuffer(self.targets, dtype=np.int64)
+        weights = np.frombuffer(self.weights, dtype=np.int64).astype(float)
+        rowSources = np.repeat(np.arange(size), np.diff(offsets))
+
+        if dense:
+            index = np.full((size, size), np.nan)
+            index[rowSources, targets] = weights
+        else:
+            index = (rowSources * size + targets, weights)
+        self._hopIndex = (dense, index)
+        return index
+
     def _validateNotation(self, notation):
         """Assumptions made here about 'notation'.
 
@@ -140,21 +789,68 @@ class Graph:
 
         return notation in self.LEGAL_NOTATIONS
 
-    """ Simple mapping of nodes with the current limit
+    """Stop-layered dynamic programming, we only need how many walks
+    there are, not the walks themselves. walks[v] holds the number of
+    walks from source ending in v after `stops` stops, one more stop is
+    one pass over the out edges of the nodes reached so far, so the whole
+    count is O(limit * |E|) time and O(|V|) memory no matter how many
+    walks exist. Python ints do not overflow, large counts stay exact.
+    Nodes too many stops away from destination (see _stopsTo) are
+    dropped from the layers.
+
+    '==' counts exactly 'limit' stops, '<=' 1 up to 'limit' stops
+    and '<' 1 up to 'limit - 1' stops, a trip needs at least one stop
     """
 
-    def _mapNeighborsWithLimit(self, neighbors: list, limit: int, path: list):
-        enqueue = deque()
-        for neighbor in neighbors:
-            enqueue.append(
-                {"node": neighbor, "limit": limit, "path": path + [neighbor]}
+    def _countWalksWithLimit(
+        self, source: int, destination: int, limit: int, notation: str
+    ):
+        if notation == "==":
+            lowest, highest = limit, limit
+        elif notation == "<=":
+            lowest, highest = 1, limit
+        else:  # "<"
+            lowest, highest = 1, limit - 1
+
+        offsets, targets = self.offsets, self.targets
+        hops = self._stopsTo(destination)
+        if self.KERNELS:
+            counts = self._walksKernel(
+                source, lowest, highest,
+                [KERNEL_INFINITY if hop == math.inf else hop for hop in hops],
             )
-        return enqueue
+            if counts is not None:
+                return int(counts[destination])
+
+        count = 0
+        walks = {source: 1}
+        relaxations = expanded = peak = 0
+        for stops in range(1, highest + 1):
+            following = defaultdict(int)
+            for current, ways in walks.items():
+                relaxations += offsets[current + 1] - offsets[current]
+                for index in range(offsets[current], offsets[current + 1]):
+                    # skip what cannot be back at destination in time
+                    if hops[targets[index]] <= highest - stops:
+                        following[targets[index]] += ways
+            expanded += len(walks)
+            walks = following
+            peak = max(peak, len(walks))
+            if stops >= lowest:
+                count += walks.get(destination, 0)
+            if not walks:
+                break  # dead end everywhere, no longer walk exists
 
-    """ Queue approach to count all unique paths by only going as deep
-    as the limit for all breadths
+        self._record(relaxations, expanded, expanded, peak)
+        return count
+
+    """Count all trips (walks, stations may repeat) from source to
+    destination with a stop limit, see _countWalksWithLimit.
+    The name is kept for callers, use findAllPathsWithLimit to get the
+    trips themselves
     """
 
+    @_instrumented
     def countAllUniquePathsWithLimitByBFS(
         self, source: str, destination: str, limit: int, notation: str = None
     ):
@@ -163,65 +859,283 @@ class Graph:
             # raise NotationError(f"{notation} is not a valid notation")
             return f"NotationError {notation} is not a valid notation"
 
-        count = 0
-        paths = []
-        queue = self._mapNeighborsWithLimit(
-            self.graph[source],
-            limit - 1,
-            [source],
-        )
-
-        while queue:  # O(|V * E|) op
-            node = queue.popleft()
-            current = node["node"]
-            current_limit = node["limit"] - 1
-            path = node["path"]
-
-            # Equal case
-            if notation == "==":  # exactly 'limit' stops
-                if current == destination and current_limit == -1:
-                    if path not in paths:
-                        count += 1
-                        paths.append(path)
-                        # print(path) # debug
-                        path = [source]
-                if current_limit >= 0:
-                    queue.extend(
-                        self._mapNeighborsWithLimit(
-                            self.graph[current], current_limit, path
-                        )
-                    )
-            elif notation == "<=":  # maximum of 'limit' stops
-                # 'less or equal to' cases
-                if current == destination:
-                    if path not in paths:
-                        count += 1
-                        paths.append(path)
-                        # print(path) # debug
-                        path = [source]
-                if current_limit >= 0:
-                    queue.extend(
-                        self._mapNeighborsWithLimit(
-                            self.graph[current], current_limit, path
-                        )
-                    )
-            elif notation == "<":  # less than 'limit' stops
-                # 'Less than' case
-                if current == destination:
-                    if path not in paths:
-                        count += 1
-                        paths.append(path)
-                        # print(path) # debug
-                        path = [source]
-                if current_limit > 0:
-                    queue.extend(
-                        self._mapNeighborsWithLimit(
-                            self.graph[current], current_limit, path
-                        )
-                    )
-            # else # dont care
+        if source not in self.nodes or destination not in self.nodes:
+            return 0  # nothing leaves or reaches an unknown station
+        source, destination = self.nodes[source], self.nodes[destination]
 
-        return count
+        # the DP costs a pass over the edges per stop, squaring costs
+        # a couple of |V|^3 products per bit of the limit
+        size = len(self.labels)
+        if np is not None and limit > 1 and \
+           2 * size ** 3 * limit.bit_length() < limit * len(self.targets):
+            counts = self._countWalksByPowers(limit, notation)
+            return int(counts[source][destination])
+
+        return self._countWalksWithLimit(source, destination, limit, notation)
+
+    """Trip counts between every pair of stations at once, by powers of
+    the adjacency matrix: (A^k)[u][v] is the number of walks of exactly
+    k stops from u to v. A^k takes O(log k) products by repeated
+    squaring, and the sums for '<=' and '<' ride along the same
+    squarings, with S(k) = A + ... + A^k
+        A^(i + j) = A^i A^j,    S(i + j) = S(i) + A^i S(j)
+    so the whole table is O(|V|^3 log limit) however long the trips.
+
+    Counts grow exponentially with the limit. They stay exact Python
+    ints (NumPy object arrays), or with 'modulus' are taken modulo it,
+    in plain int64 when the products cannot overflow. Without NumPy the
+    same products run on lists of lists.
+
+    Returns the |V| x |V| table in the order of graph.labels, a NumPy
+    array or a list of lists without NumPy
+    """
+
+    @_instrumented
+    def countAllRoutesWithLimit(
+        self, limit: int, notation: str = None, modulus: int = None
+    ):
+        if not self._validateNotation(notation):
+            return f"NotationError {notation} is not a valid notation"
+        if modulus is not None and modulus < 1:
+            return f"ValueError modulus {modulus} is not positive"
+        return self._countWalksByPowers(limit, notation, modulus)
+
+    """One to many trip counts, the stop-layered DP of
+    _countWalksWithLimit already carries the count of every node at
+    every stop, adding them all up answers every destination (or each
+    station in 'targets') from the same pass
+    """
+
+    @_instrumented
+    def countRoutesFrom(
+        self,
+        source: str,
+        limit: int,
+        notation: str = None,
+        targets: list = None,
+    ):
+        if not self._validateNotation(notation):
+            return f"NotationError {notation} is not a valid notation"
+        labels = self.labels if targets is None else list(targets)
+        if source not in self.nodes:
+            return {label: 0 for label in labels}
+        source = self.nodes[source]
+
+        size = len(self.labels)
+        if np is not None and limit > 1 and \
+           2 * size ** 3 * limit.bit_length() < limit * len(self.targets):
+            counts = self._countWalksByPowers(limit, notation)[source]
+        else:
+            counts = self._countWalksFrom(source, limit, notation)
+        return {
+            label: int(counts[self.nodes[label]]) if label in self.nodes
+            else 0
+            for label in labels
+        }
+
+    def _countWalksFrom(self, source: int, limit: int, notation: str):
+        if notation == "==":
+            lowest, highest = limit, limit
+        elif notation == "<=":
+            lowest, highest = 1, limit
+        else:  # "<"
+            lowest, highest = 1, limit - 1
+
+        if self.KERNELS:
+            counts = self._walksKernel(
+                source, lowest, highest, [0] * len(self.labels)
+            )
+            if counts is not None:
+                return counts.tolist()
+
+        offsets, targets = self.offsets, self.targets
+        counts = [0] * len(self.labels)
+        walks = {source: 1}
+        relaxations = expanded = peak = 0
+        for stops in range(1, highest + 1):
+            following = defaultdict(int)
+            for current, ways in walks.items():
+                relaxations += offsets[current + 1] - offsets[current]
+                for index in range(offsets[current], offsets[current + 1]):
+                    following[targets[index]] += ways
+            expanded += len(walks)
+            walks = following
+            peak = max(peak, len(walks))
+            if stops >= lowest:
+                for node, ways in walks.items():
+                    counts[node] += ways
+            if not walks:
+                break
+
+        self._record(relaxations, expanded, expanded, peak)
+        return counts
+
+    def _walksKernel(self, source: int, lowest: int, highest: int, hops):
+        """Both stop-layered counts through the compiled kernel, None
+        when the counts outgrow int64 and need Python ints
+        """
+        offsets, targets = self._kernelRows("offsets", "targets")
+        counts, relaxations, expanded, peak, exact = _walksKernel(
+            offsets, targets, source, lowest, highest,
+            np.array(hops, dtype=np.int64),
+        )
+        if not exact:
+            return None
+        self._record(relaxations, expanded, expanded, peak)
+        return counts
+
+    def _kernelRows(self, *names: str):
+        """NumPy views of the named CSR rows for the kernels, no copies"""
+        return [
+            np.frombuffer(getattr(self, name), dtype=np.int64)
+            for name in names
+        ]
+
+    def _countWalksByPowers(
+        self, limit: int, notation: str, modulus: int = None
+    ):
+        size = len(self.labels)
+        highest = limit - 1 if notation == "<" else limit
+        sums = notation != "=="
+
+        if np is not None:
+            exact = modulus is None or size * (modulus - 1) ** 2 >= 2 ** 63
+            dtype = object if exact else np.int64
+            adjacency = np.zeros((size, size), dtype=dtype)
+            degrees = np.diff(np.frombuffer(self.offsets, dtype=np.int64))
+            adjacency[
+                np.repeat(np.arange(size), degrees),
+                np.frombuffer(self.targets, dtype=np.int64),
+            ] = 1
+            identity = np.identity(size, dtype=dtype)
+            zero = np.zeros((size, size), dtype=dtype)
+        else:
+            adjacency = [[0] * size for _ in range(size)]
+            for u in range(size):
+                for index in range(self.offsets[u], self.offsets[u + 1]):
+                    adjacency[u][self.targets[index]] = 1
+            identity = [
+                [int(u == v) for v in range(size)] for u in range(size)
+            ]
+            zero = [[0] * size for _ in range(size)]
+
+        products = 0
+
+        def multiply(a, b):
+            nonlocal products
+            products += 1
+            if np is not None:
+                c = a @ b
+                return c % modulus if modulus else c
+            c = [[0] * size for _ in range(size)]
+            for row, out in zip(a, c):
+                for k, ways in enumerate(row):
+                    if not ways:
+                        continue
+                    for v, more in enumerate(b[k]):
+                        if more:
+                            out[v] += ways * more
+                if modulus:
+                    out[:] = [ways % modulus for ways in out]
+            return c
+
+        def add(a, b):
+            if np is not None:
+                c = a + b
+                return c % modulus if modulus else c
+            return [
+                [(x + y) % modulus if modulus else x + y
+                 for x, y in zip(p, q)]
+                for p, q in zip(a, b)
+            ]
+
+        # (A^i, S(i)) pairs, 'power' for the bits of highest seen so far
+        power, total = identity, zero
+        base, baseTotal = adjacency, adjacency
+        remaining = max(highest, 0)
+        while remaining:
+            if remaining & 1:
+                if sums:
+                    total = add(total, multiply(power, baseTotal))
+                power = multiply(power, base)
+            remaining >>= 1
+            if remaining:
+                if sums:
+                    baseTotal = add(baseTotal, multiply(base, baseTotal))
+                base = multiply(base, base)
+
+        self._record(relaxations=products * size ** 3, expanded=products)
+        if sums:
+            return total
+        return power if highest > 0 else zero  # a trip has a stop at least
+
+    """ Queue approach to list all unique paths by only going as deep
+    as the limit for all breadths, one breadth (stop) at a time.
+
+    Routes are kept as a trie of their prefixes, flat arrays where entry
+    i is the station nodes[i] reached from the prefix parents[i], so
+    walks sharing a beginning share its entries and a new breadth costs
+    two integers per walk, not a copy of the walk. A breadth is the
+    range of entries added for it, the queue is the trie itself.
+    Every prefix is a different walk by construction (one entry per edge
+    taken from a given prefix), so there is nothing to deduplicate.
+    Only walks that can still get to destination in the stops left are
+    extended (see _stopsTo), the labels are spelt out once at the end.
+    The bytes held by the trie are reported as peakBytes
+    """
+
+    @_instrumented
+    def findAllPathsWithLimit(
+        self, source: str, destination: str, limit: int, notation: str = None
+    ):
+        if not self._validateNotation(notation):
+            return f"NotationError {notation} is not a valid notation"
+
+        if source not in self.nodes:
+            return []  # nothing leaves an unknown station
+        source = self.nodes[source]
+        destination = self.nodes.get(destination, -1)
+        highest = limit - 1 if notation == "<" else limit
+        hops = self._stopsTo(destination)
+
+        offsets, targets = self.offsets, self.targets
+        nodes, parents = array("q", [source]), array("q", [-1])
+        ends = array("q")  # trie entries where a route stops
+        breadth = range(0, 1)
+        relaxations = peak = 0
+        for stops in range(1, highest + 1):
+            for prefix in breadth:
+                current = nodes[prefix]
+                relaxations += offsets[current + 1] - offsets[current]
+                for index in range(offsets[current], offsets[current + 1]):
+                    neighbor = targets[index]
+                    if hops[neighbor] > highest - stops:
+                        continue  # cannot be at destination in time
+                    nodes.append(neighbor)
+                    parents.append(prefix)
+                    if neighbor == destination and \
+                       (notation != "==" or stops == limit):
+                        ends.append(len(nodes) - 1)
+            breadth = range(breadth.stop, len(nodes))
+            peak = max(peak, len(breadth))
+            if not breadth:
+                break  # no walk left to extend
+
+        size = len(nodes) - 1
+        self._record(
+            relaxations, size, size, peak,
+            (len(nodes) + len(parents) + len(ends)) * nodes.itemsize,
+        )
+
+        paths = []
+        for end in ends:
+            path = []
+            while end != -1:
+                path.append(self.labels[nodes[end]])
+                end = parents[end]
+            path.reverse()
+            paths.append(path)
+        return paths
 
     """Find the shortest path between two nodes
 
@@ -229,98 +1143,2082 @@ class Graph:
     following the theme of practicality, we will go with Bellman-Ford
     to allow negative weights to exist and throw exception for negative
     weight cycles
+
+    Only reached through method="bellman-ford", automatic queries on
+    negative weights go to _labelCorrecting instead.
+    A pass that relaxes nothing means every distance is final, we stop
+    there instead of running all |V| - 1 of them. A pass |V| that still
+    relaxes something means a negative cycle, which we hand back as a
+    NegativeCycleError (see _negativeCycle) instead of distances
     """
 
     def _bellmanFord(
         self,
-        source: str,
-        destination: str,
+        source: int,
+        destination: int,
+        parents: array = None,
+    ):
+        offsets, targets, weights = self.offsets, self.targets, self.weights
+        size = len(self.labels)
+        if parents is None:
+            parents = array("q", [-1]) * size  # to spell a negative cycle
+
+        if self.VECTORIZED and not self.KERNELS:
+            return self._vectorizedBellmanFord(source, destination, parents)
+
+        if self.KERNELS:
+            distances, relaxations, passes, changed = _relaxKernel(
+                *self._kernelRows("offsets", "targets", "weights"),
+                source, np.frombuffer(parents, dtype=np.int64),
+            )
+            distances = [
+                math.inf if distance == KERNEL_INFINITY else distance
+                for distance in distances.tolist()
+            ]
+        else:
+            # set all node distances from source to infinity
+            distances = [math.inf] * size
+            distances[source] = 0
+
+            # relaxation is equal to the longest possible
+            # shortest path which is `len(nodes) - 1`, one more pass
+            # relaxing anything is the negative-weight cycle check
+            relaxations = passes = 0
+            changed = -1
+            for relax in range(size):
+                passes += 1
+                changed = -1
+                for u in range(size):
+                    if distances[u] == math.inf:
+                        continue  # not reached yet, nothing to relax from
+                    relaxations += offsets[u + 1] - offsets[u]
+                    for index in range(offsets[u], offsets[u + 1]):
+                        v = targets[index]
+                        # if that distance + weight of u-v is smaller
+                        # than recorded distance[v], we've found a
+                        # 'shorter path' to v
+                        if distances[u] + weights[index] < distances[v]:
+                            distances[v] = distances[u] + weights[index]
+                            parents[v] = u
+                            changed = v
+                if changed == -1:
+                    break  # nothing moved, nothing will
+
+        self._record(relaxations=relaxations, expanded=passes)
+
+        if changed != -1:
+            return self._negativeCycle(parents, int(changed))
+
+        # special case where source is destination, the trip has to come
+        # back through one of the incoming edges of the source
+        if source == destination:
+            distances[source] = self._roundTrip(source, distances)
+
+        return distances
+
+    """Bellman-Ford a pass at a time instead of an edge at a time. A pass
+    is a min over every edge at once, np.minimum.at folds the candidates
+    distance[u] + weight into distance[v] for all of them. Every pass
+    reads the distances of the pass before (a Jacobi sweep where the
+    loop above is Gauss-Seidel), so pass k has every walk of k edges and
+    a pass |V| that still lowers a distance is a negative cycle. It can
+    take more passes than the loop, each one is a handful of vector ops.
+
+    Only the rows of nodes lowered by the last pass can lower anything,
+    their edge indices are gathered straight from the offsets. The
+    parents are set from the edges that won. Any cycle they form is a
+    negative one, and pointer doubling over them (every node jumps to
+    the parent of its parent, log |V| times) lands each node either past
+    the source or on such a cycle
+    """
+
+    def _vectorizedBellmanFord(
+        self,
+        source: int,
+        destination: int,
+        parents: array = None,
+        reverse: bool = False,
+        within: bytearray = None,
     ):
-        # set all node distances from source to infinity
-        distances = dict.fromkeys(self.nodes, math.inf)
+        offsets, targets, weights = self._kernelRows(
+            *self._rowNames(reverse)
+        )
+        size = len(self.labels)
+        if parents is None:
+            parents = array("q", [-1]) * size
+        predecessors = np.frombuffer(parents, dtype=np.int64)
+
+        distances = np.full(size, KERNEL_INFINITY, dtype=np.int64)
         distances[source] = 0
+        lowered = np.array([source])
+        relaxations = passes = 0
+        while len(lowered) and passes < size:
+            passes += 1
+            # edge indices of the lowered rows, one range per row
+            starts = offsets[lowered]
+            degrees = offsets[lowered + 1] - starts
+            edges = np.repeat(starts - np.cumsum(degrees) + degrees, degrees)
+            edges += np.arange(len(edges))
+            relaxations += len(edges)
+
+            tails = np.repeat(lowered, degrees)
+            heads = targets[edges]
+            if within is not None:
+                kept = np.frombuffer(within, dtype=np.uint8)[heads] != 0
+                edges, tails, heads = edges[kept], tails[kept], heads[kept]
+            candidates = distances[tails] + weights[edges]
+            following = distances.copy()
+            np.minimum.at(following, heads, candidates)
+            won = candidates == following[heads]
+            won &= following[heads] < distances[heads]
+            predecessors[heads[won]] = tails[won]
+            lowered = np.flatnonzero(following < distances)
+            distances = following
+
+        self._record(relaxations=relaxations, expanded=passes)
+
+        if len(lowered):
+            # parent of the parent until 2^k >= |V|, -1 goes to a sink
+            jumps = np.append(predecessors, size)
+            jumps[jumps == -1] = size
+            for _ in range(size.bit_length()):
+                jumps = jumps[jumps]
+            cyclic = jumps[lowered]
+            cyclic = cyclic[cyclic != size]
+            return self._negativeCycle(parents, int(cyclic[0]), reverse)
+
+        distances = [
+            math.inf if distance == KERNEL_INFINITY else distance
+            for distance in distances.tolist()
+        ]
+        if source == destination:
+            distances[source] = self._roundTrip(source, distances)
+        return distances
+
+    """SPFA, Bellman-Ford that only relaxes the rows of nodes whose
+    distance just dropped, kept in a FIFO queue. Same answers and the same
+    O(|V||E|) worst case, but a pass over nodes nothing happened to is
+    never made, which on sparse networks with a few negative edges (fare
+    rebates) is most of them.
 
-        sourceIsDestination = source == destination
+    A negative cycle never lets the queue drain, so every node counts the
+    edges on its current shortest path: |V| of them means the path
+    repeats a node. The parents then hold a cycle, found by
+    _negativeCycle; while they do not hold one yet we keep relaxing.
+
+    reverse=True runs over the reverse rows (distances to source), and
+    nodes with within[v] == 0 are never relaxed, so only a negative
+    cycle among the others counts
+    """
 
-        # relaxation is equal to the longest possible
-        # shortest path which is `len(nodes) - 1`
-        for relax in range(len(self.nodes) - 1):
-            for (u, v, w) in self.weightedGraph:
-                # special case where source is destination
-                # override distance of source once
-                if distances[u] != math.inf and \
-                   v == destination and \
-                   sourceIsDestination:
+    def _spfa(
+        self,
+        source: int,
+        destination: int,
+        parents: array = None,
+        reverse: bool = False,
+        within: bytearray = None,
+    ):
+        offsets, targets, weights = (
+            getattr(self, name) for name in self._rowNames(reverse)
+        )
+        size = len(self.labels)
+        if parents is None:
+            parents = array("q", [-1]) * size
 
-                    sourceIsDestination = False
-                    distances[v] = distances[u] + int(w)
+        if self.KERNELS:
+            distances, relaxations, pushes, expanded, peak, changed = \
+                _spfaKernel(
+                    *self._kernelRows(*self._rowNames(reverse)),
+                    source, np.frombuffer(parents, dtype=np.int64),
+                    np.ones(size, dtype=np.uint8) if within is None
+                    else np.frombuffer(within, dtype=np.uint8),
+                )
+            distances = [
+                math.inf if distance == KERNEL_INFINITY else distance
+                for distance in distances.tolist()
+            ]
+            cycle = None
+            if changed != -1:
+                cycle = self._negativeCycle(parents, int(changed), reverse)
+        else:
+            distances = [math.inf] * size
+            distances[source] = 0
+            hops = [0] * size  # edges on the shortest path found so far
+            queued = bytearray(size)
+            queue = deque([source])
+            queued[source] = 1
+            relaxations = pushes = expanded = peak = 0
+            cycle = None
 
-                elif (
-                    distances[u] != math.inf and
-                    distances[u] + int(w) < distances[v]
-                ):
+            while queue and cycle is None:
+                peak = max(peak, len(queue))
+                u = queue.popleft()
+                queued[u] = 0
+                expanded += 1
+                relaxations += offsets[u + 1] - offsets[u]
+                for index in range(offsets[u], offsets[u + 1]):
+                    v = targets[index]
+                    if within is not None and not within[v]:
+                        continue
+                    if distances[u] + weights[index] < distances[v]:
+                        distances[v] = distances[u] + weights[index]
+                        parents[v] = u
+                        hops[v] = hops[u] + 1
+                        if hops[v] >= size:
+                            cycle = self._negativeCycle(parents, v, reverse)
+                            if cycle is not None:
+                                break
+                        if not queued[v]:
+                            queued[v] = 1
+                            queue.append(v)
+                            pushes += 1
 
-                    # if distance of source is not infinity (not reached yet)
-                    # and that distance + weight of u-v is smaller than
-                    # recorded distance[v], we've found a 'shorter path' to v
-                    distances[v] = distances[u] + int(w)
+        self._record(relaxations, pushes, expanded, peak)
 
-        # negative-weight cycle check
-        for (u, v, w) in self.weightedGraph:
-            if distances[u] != math.inf and \
-               distances[u] + int(w) < distances[v]:
+        if cycle is not None:
+            return cycle
 
-                return f"NegativeCycleError: distance of {u} + {w}" \
-                       " is less than distance to {v}"
+        if source == destination:
+            distances[source] = self._roundTrip(source, distances)
 
-        print(distances)
         return distances
 
-    def findLengthOfShortestPathBetweenTwo(
+    def _labelCorrecting(
         self,
-        source: str,
-        destination: str,
+        source: int,
+        destination: int,
+        parents: array = None,
+        reverse: bool = False,
+        within: bytearray = None,
     ):
-        if not set([source, destination]) <= set(self.nodes):
-            return "NO SUCH ROUTE"
+        """The engine for negative weights, SPFA (compiled with kernels)
+        or without kernels the NumPy passes, far ahead of SPFA in Python
+        """
+        if self.VECTORIZED and not self.KERNELS:
+            engine = self._vectorizedBellmanFord
+        else:
+            engine = self._spfa
+        return engine(source, destination, parents, reverse, within)
 
-        # Bellman-Ford for all distances from source
-        return self._bellmanFord(source, destination)[destination]
+    def _rowNames(self, reverse: bool = False):
+        if reverse:
+            return "reverseOffsets", "reverseTargets", "reverseWeights"
+        return "offsets", "targets", "weights"
 
-    def countAllUniquePathsBelowWeight(
+    """Walk the parents back from a node that kept relaxing, the first
+    node met twice is on a cycle of the parent graph, and any cycle there
+    is a negative one (each edge on it was relaxed after the one before).
+    None when the walk runs out at the source instead. After a search
+    over the reverse rows the parents already point down the edges
+    """
+
+    def _negativeCycle(self, parents: array, node: int, reverse=False):
+        seen = set()
+        while node != -1 and node not in seen:
+            seen.add(node)
+            node = parents[node]
+        if node == -1:
+            return None
+
+        cycle = [node]
+        current = parents[node]
+        while current != node:
+            cycle.append(current)
+            current = parents[current]
+        cycle.append(node)
+        if not reverse:
+            cycle.reverse()
+        return NegativeCycleError([self.labels[v] for v in cycle])
+
+    """Binary heap Dijkstra over the CSR rows, only valid when
+    every weight is non-negative (see self.nonNegative)
+
+    Unlike _bellmanFord this stops as soon as the destination is settled,
+    nodes further away than the destination are never expanded.
+    When source is destination we are after the shortest round trip,
+    so the source starts at 0 but the destination is only settled
+    once we come back to it through one of its incoming edges.
+    """
+
+    def _dijkstra(
         self,
-        source: str,
-        destination: str,
-        weight: int,
+        source: int,
+        destination: int,
     ):
-        if not set([source, destination]) <= set(self.nodes):
-            return "NO SUCH ROUTE"
+        offsets, targets, weights = self.offsets, self.targets, self.weights
+        distances = [math.inf] * len(self.labels)
+        distances[source] = 0
+        settled = bytearray(len(self.labels))
+        roundTrip = math.inf
+        found = math.inf
+        heap = [(0, source)]
+        relaxations = pushes = expanded = peak = 0
 
-        count = 0
-        paths = []
-        queue = deque([(source, [source], weight)])
-        # FIFO queue
-        while queue:
-            (current, path, remaining_weight) = queue.popleft()
-
-            for neighbor in self.graph[current]:
-                neighbor_weight = self.hashTable[current + neighbor].weight
-                temp_path = path + [neighbor]
-                temp_weight = remaining_weight - neighbor_weight
-                # there's still some 'gas left in the tank'
-                if neighbor_weight < remaining_weight:
-                    queue.append((
-                        neighbor,
-                        temp_path,
-                        temp_weight,
-                    ))
-                    # we've arrived!
-                    if neighbor == destination:
-                        print(weight - temp_weight, temp_path)
-                        paths.append({
-                            "weight": weight - temp_weight,
-                            "path": temp_path,
-                        })
-                        count += 1
+        while heap:
+            peak = max(peak, len(heap))
+            distance, current = heapq.heappop(heap)
+            if settled[current]:
+                continue  # stale entry, already settled with a smaller one
+            if source == destination and roundTrip <= distance:
+                break
+            if current == destination and source != destination:
+                found = distance
+                break
+            settled[current] = 1
+            expanded += 1
+            relaxations += offsets[current + 1] - offsets[current]
 
-        return count
+            for index in range(offsets[current], offsets[current + 1]):
+                neighbor = targets[index]
+                candidate = distance + weights[index]
+                if neighbor == destination and source == destination:
+                    roundTrip = min(roundTrip, candidate)
+                elif candidate < distances[neighbor]:
+                    distances[neighbor] = candidate
+                    heapq.heappush(heap, (candidate, neighbor))
+                    pushes += 1
+
+        self._record(relaxations, pushes, expanded, peak)
+        return roundTrip if source == destination else found
+
+    """Bidirectional Dijkstra, one search forward from source over the CSR
+    rows and one backward from destination over the reverse rows, always
+    growing the smaller frontier. Every edge relaxed toward a node the
+    other side has reached gives a candidate length, and we can stop
+    once the two smallest open distances add up to the best candidate:
+    nothing left on either heap can make a shorter path.
+    Each search only covers about half the distance, on a road or rail
+    network that is a fraction of the nodes a one sided search settles
+    """
+
+    def _bidirectionalDijkstra(self, source: int, destination: int):
+        sides = [
+            (self.offsets, self.targets, self.weights,
+             {source: 0}, [(0, source)], set()),
+            (self.reverseOffsets, self.reverseTargets, self.reverseWeights,
+             {destination: 0}, [(0, destination)], set()),
+        ]
+        best = 0 if source == destination else math.inf
+        relaxations = pushes = expanded = peak = 0
+
+        while sides[0][4] and sides[1][4]:
+            if sides[0][4][0][0] + sides[1][4][0][0] >= best:
+                break
+            side = 0 if len(sides[0][4]) <= len(sides[1][4]) else 1
+            offsets, targets, weights, distances, heap, settled = sides[side]
+            other = sides[1 - side][3]
+
+            peak = max(peak, len(sides[0][4]) + len(sides[1][4]))
+            distance, current = heapq.heappop(heap)
+            if current in settled:
+                continue  # stale entry
+            settled.add(current)
+            expanded += 1
+            relaxations += offsets[current + 1] - offsets[current]
+
+            for index in range(offsets[current], offsets[current + 1]):
+                neighbor = targets[index]
+                candidate = distance + weights[index]
+                if candidate < distances.get(neighbor, math.inf):
+                    distances[neighbor] = candidate
+                    heapq.heappush(heap, (candidate, neighbor))
+                    pushes += 1
+                    if neighbor in other:
+                        best = min(best, candidate + other[neighbor])
+
+        self._record(relaxations, pushes, expanded, peak)
+        return best
+
+    """ALT: A* with landmarks and the triangle inequality. For a landmark L
+        d(v, t) >= d(L, t) - d(L, v)  and  d(v, t) >= d(v, L) - d(t, L)
+    so the largest of those over a few landmarks is a lower bound of the
+    distance left, which steers the search toward the destination.
+    The bound is consistent, a node is settled once like in Dijkstra.
+    Landmarks are picked far apart (each one the farthest node from those
+    already picked) and need one forward and one reverse Dijkstra each,
+    see precomputeLandmarks
+    """
+
+    def precomputeLandmarks(self, count: int = None):
+        if not self.nonNegative:
+            return "MethodError alt needs non-negative weights"
+        count = self.LANDMARKS if count is None else count
+        size = len(self.labels)
+        landmarks = []
+        closest = [math.inf] * size  # distance to the nearest landmark
+        # start from the busiest station, every next one as far as it gets
+        landmark = max(
+            range(size),
+            key=lambda node: self.offsets[node + 1] - self.offsets[node],
+            default=None,
+        )
+        while landmark is not None and len(landmarks) < count:
+            fromLandmark = self._shortestDistances(landmark)
+            toLandmark = self._shortestDistances(landmark, reverse=True)
+            landmarks.append((fromLandmark, toLandmark))
+            for node in range(size):
+                closest[node] = min(
+                    closest[node], fromLandmark[node], toLandmark[node]
+                )
+            farthest = max(
+                (node for node in range(size) if closest[node] != math.inf),
+                key=lambda node: closest[node],
+                default=None,
+            )
+            if farthest is None or closest[farthest] == 0:
+                break  # every reachable node is a landmark already
+            landmark = farthest
+
+        self._landmarks = landmarks
+        return None
+
+    def _landmarkBound(self, node: int, destination: int):
+        bound = 0
+        for fromLandmark, toLandmark in self._landmarks:
+            if fromLandmark[node] != math.inf and \
+               fromLandmark[destination] != math.inf:
+                bound = max(
+                    bound, fromLandmark[destination] - fromLandmark[node]
+                )
+            if toLandmark[destination] != math.inf:
+                if toLandmark[node] == math.inf:
+                    # destination gets to L but node does not, so node
+                    # cannot get to destination either
+                    return math.inf
+                bound = max(bound, toLandmark[node] - toLandmark[destination])
+        return bound
+
+    def _alt(self, source: int, destination: int):
+        if self._landmarks is None:
+            self.precomputeLandmarks()
+        offsets, targets, weights = self.offsets, self.targets, self.weights
+        distances = {source: 0}
+        settled = set()
+        bounds = {}
+        heap = [(self._landmarkBound(source, destination), 0, source)]
+        found = math.inf
+        relaxations = pushes = expanded = peak = 0
+
+        while heap:
+            peak = max(peak, len(heap))
+            estimate, distance, current = heapq.heappop(heap)
+            if current in settled:
+                continue  # stale entry
+            if current == destination:
+                found = distance
+                break
+            settled.add(current)
+            expanded += 1
+            relaxations += offsets[current + 1] - offsets[current]
+
+            for index in range(offsets[current], offsets[current + 1]):
+                neighbor = targets[index]
+                candidate = distance + weights[index]
+                if candidate >= distances.get(neighbor, math.inf):
+                    continue
+                if neighbor not in bounds:
+                    bounds[neighbor] = self._landmarkBound(
+                        neighbor, destination
+                    )
+                if bounds[neighbor] == math.inf:
+                    continue  # cannot reach the destination from there
+                distances[neighbor] = candidate
+                heapq.heappush(
+                    heap, (candidate + bounds[neighbor], candidate, neighbor)
+                )
+                pushes += 1
+
+        self._record(relaxations, pushes, expanded, peak)
+        return found
+
+    """Contraction hierarchy, for networks that rarely change and take a
+    lot of point to point queries.
+
+    Nodes are contracted one by one, least important first: a contracted
+    node v disappears from the graph, and for every pair u-v-w whose
+    shortest route goes through v a shortcut u-w with the weight of
+    u-v-w takes its place. A local Dijkstra from u that avoids v (the
+    witness search) tells whether some other route is as short, then no
+    shortcut is needed. Importance is the edge difference (shortcuts
+    added minus edges removed) plus the number of contracted neighbors,
+    which spreads contraction evenly. Priorities are refreshed lazily
+    when a node comes off the heap.
+
+    The order a node was contracted in is its rank. Every edge, original
+    or shortcut, is kept once, on the lower ranked end: in the up rows
+    when it leads up to a higher rank, in the down rows (stored
+    backwards) when it comes down from one. Any shortest route is then
+    a climb from the source and a descent to the destination, so a query
+    is two small Dijkstra searches going up only (see _hierarchyDistance).
+
+    Needs non-negative weights. Any live change drops the hierarchy,
+    save and load keep it in the snapshot
+    """
+
+    @_instrumented
+    def precomputeHierarchy(self):
+        if not self.nonNegative:
+            return "MethodError hierarchy needs non-negative weights"
+        size = len(self.labels)
+        # the overlay graph of the nodes not contracted yet
+        outgoing = [{} for _ in range(size)]
+        incoming = [{} for _ in range(size)]
+        for u in range(size):
+            for index in range(self.offsets[u], self.offsets[u + 1]):
+                v, w = self.targets[index], self.weights[index]
+                outgoing[u][v] = incoming[v][u] = w
+
+        def shortcuts(v):
+            needed = []
+            for u, inWeight in incoming[v].items():
+                highest = max(
+                    (inWeight + w for x, w in outgoing[v].items() if x != u),
+                    default=None,
+                )
+                if highest is None:
+                    continue
+                witness = self._witnessSearch(outgoing, u, v, highest)
+                for x, outWeight in outgoing[v].items():
+                    via = inWeight + outWeight
+                    if x != u and witness.get(x, math.inf) > via:
+                        needed.append((u, x, via))
+            return needed
+
+        def priority(v, needed):
+            return (
+                len(needed) - len(incoming[v]) - len(outgoing[v])
+                + contractedNeighbors[v]
+            )
+
+        contractedNeighbors = [0] * size
+        heap = [(priority(v, shortcuts(v)), v) for v in range(size)]
+        heapq.heapify(heap)
+        rank = array("q", bytes(8 * size))
+        up = [None] * size
+        down = [None] * size
+        order = 0
+        while heap:
+            _, v = heapq.heappop(heap)
+            needed = shortcuts(v)
+            current = priority(v, needed)
+            if heap and current > heap[0][0]:
+                heapq.heappush(heap, (current, v))  # stale, try later
+                continue
+
+            for u, x, via in needed:
+                if via < outgoing[u].get(x, math.inf):
+                    outgoing[u][x] = incoming[x][u] = via
+            # what is left around v ranks higher than v
+            up[v], down[v] = outgoing[v], incoming[v]
+            for x in outgoing[v]:
+                del incoming[x][v]
+                contractedNeighbors[x] += 1
+            for u in incoming[v]:
+                del outgoing[u][v]
+                contractedNeighbors[u] += 1
+            outgoing[v], incoming[v] = {}, {}
+            rank[v] = order
+            order += 1
+
+        rows = [rank]
+        for edges in (up, down):
+            offsets = array("q", [0])
+            targets, weights = array("q"), array("q")
+            for node in range(size):
+                for other in sorted(edges[node]):
+                    targets.append(other)
+                    weights.append(edges[node][other])
+                offsets.append(len(targets))
+            rows += [offsets, targets, weights]
+        self._hierarchy = rows
+        return None
+
+    def _witnessSearch(self, outgoing: list, source: int, avoid: int, limit):
+        """Distances from source in the overlay graph without 'avoid', up
+        to 'limit' and WITNESS_SETTLE_LIMIT settled nodes
+        """
+        distances = {source: 0}
+        heap = [(0, source)]
+        settled = 0
+        while heap and settled < self.WITNESS_SETTLE_LIMIT:
+            distance, current = heapq.heappop(heap)
+            if distance > distances[current]:
+                continue  # stale entry
+            if distance > limit:
+                break
+            settled += 1
+            for neighbor, w in outgoing[current].items():
+                if neighbor == avoid:
+                    continue
+                if distance + w < distances.get(neighbor, math.inf):
+                    distances[neighbor] = distance + w
+                    heapq.heappush(heap, (distance + w, neighbor))
+        return distances
+
+    """Hierarchy query, Dijkstra up from source over the up rows and up
+    from destination over the down rows, taking turns. Where the two
+    meet is a candidate, a side stops once its heap only holds entries
+    no shorter than the best candidate. Both searches stay in the top of
+    the hierarchy above their own end, a few hundred nodes on road and
+    rail networks of millions
+    """
+
+    def _hierarchyDistance(self, source: int, destination: int):
+        rank, upOffsets, upTargets, upWeights, \
+            downOffsets, downTargets, downWeights = self._hierarchy
+        sides = [
+            (upOffsets, upTargets, upWeights, {source: 0}, [(0, source)]),
+            (downOffsets, downTargets, downWeights,
+             {destination: 0}, [(0, destination)]),
+        ]
+        best = math.inf
+        relaxations = pushes = expanded = peak = 0
+        side = 0
+        while sides[0][4] or sides[1][4]:
+            if not sides[side][4]:
+                side = 1 - side
+            offsets, targets, weights, distances, heap = sides[side]
+            other = sides[1 - side][3]
+            peak = max(peak, len(sides[0][4]) + len(sides[1][4]))
+
+            distance, current = heapq.heappop(heap)
+            if distance >= best:
+                heap.clear()  # nothing shorter left on this side
+                continue
+            if distance > distances[current]:
+                continue  # stale entry
+            expanded += 1
+            if current in other:
+                best = min(best, distance + other[current])
+            relaxations += offsets[current + 1] - offsets[current]
+            for index in range(offsets[current], offsets[current + 1]):
+                neighbor = targets[index]
+                candidate = distance + weights[index]
+                if candidate < distances.get(neighbor, math.inf):
+                    distances[neighbor] = candidate
+                    heapq.heappush(heap, (candidate, neighbor))
+                    pushes += 1
+            side = 1 - side
+
+        self._record(relaxations, pushes, expanded, peak)
+        return best
+
+    def _validateMethod(self, method):
+        return method is None or method in self.SHORTEST_PATH_METHODS
+
+    """'method' forces one engine, by default a precomputed table,
+    contraction hierarchy or cached source is used when there is one,
+    then Dijkstra, or SPFA (see _labelCorrecting) when some weight is
+    negative. 'bidirectional', 'alt' and 'hierarchy' are for point to
+    point queries on non-negative graphs, a round trip (source is
+    destination) goes to Dijkstra
+    """
+
+    @_instrumented
+    def findLengthOfShortestPathBetweenTwo(
+        self,
+        source: str,
+        destination: str,
+        method: str = None,
+    ):
+        if not self._validateMethod(method):
+            return f"MethodError {method} is not a valid method"
+
+        if source not in self.nodes or destination not in self.nodes:
+            return "NO SUCH ROUTE"
+        source, destination = self.nodes[source], self.nodes[destination]
+
+        if method in ["bidirectional", "alt", "hierarchy", "dijkstra"]:
+            if not self.nonNegative:
+                return f"MethodError {method} needs non-negative weights"
+            if method == "dijkstra" or source == destination:
+                return self._dijkstra(source, destination)
+            if method == "bidirectional":
+                return self._bidirectionalDijkstra(source, destination)
+            if method == "hierarchy":
+                if self._hierarchy is None:
+                    self.precomputeHierarchy()
+                return self._hierarchyDistance(source, destination)
+            return self._alt(source, destination)
+
+        if method in ["bellman-ford", "spfa"]:
+            engine = self._bellmanFord if method == "bellman-ford" \
+                else self._spfa
+            distances = engine(source, destination)
+            if isinstance(distances, str):
+                return distances  # negative cycle
+            return distances[destination]
+
+        # precomputed table, a plain lookup
+        if self._allPairs is not None:
+            if source == destination:
+                return self._asDistance(self._roundTrips[source])
+            return self._asDistance(self._allPairs[source][destination])
+
+        if self._hierarchy is not None and source != destination:
+            return self._hierarchyDistance(source, destination)
+
+        # every distance from source is kept for the next query from there
+        if self.cacheSize:
+            distances = self._singleSource(source)
+            if isinstance(distances, str):
+                return distances  # negative cycle
+            if source == destination:
+                return self._roundTrip(source, distances)
+            return distances[destination]
+
+        # Dijkstra stops early but needs non-negative weights
+        if self.nonNegative:
+            return self._dijkstra(source, destination)
+
+        # SPFA or NumPy Bellman-Ford for all distances from source
+        distances = self._labelCorrecting(source, destination)
+        if isinstance(distances, str):
+            return distances  # negative cycle
+        return distances[destination]
+
+    """Plain Dijkstra without a destination, distances from source to
+    every node (or to source from every node with reverse=True, by
+    running over the reverse rows). Needs non-negative weights, or
+    a Johnson potential (see _potentials) that makes them non-negative.
+    'parents' gets the node each one was last relaxed from. With 'until'
+    the search stops once every node in it is settled, the distances of
+    nodes outside it may then still be too long
+    """
+
+    def _shortestDistances(
+        self,
+        source: int,
+        reverse: bool = False,
+        potential: list = None,
+        parents: array = None,
+        until: set = None,
+    ):
+        if reverse:
+            offsets, targets = self.reverseOffsets, self.reverseTargets
+            weights = self.reverseWeights
+        else:
+            offsets, targets, weights = (
+                self.offsets, self.targets, self.weights
+            )
+
+        distances = [math.inf] * len(self.labels)
+        distances[source] = 0
+        heap = [(0, source)]
+        waiting = len(until) if until is not None else -1
+        relaxations = pushes = expanded = peak = 0
+        while heap:
+            peak = max(peak, len(heap))
+            distance, current = heapq.heappop(heap)
+            if distance > distances[current]:
+                continue  # stale entry
+            if until is not None and current in until:
+                waiting -= 1
+                if waiting == 0:
+                    break  # every node asked for is settled
+            expanded += 1
+            relaxations += offsets[current + 1] - offsets[current]
+            for index in range(offsets[current], offsets[current + 1]):
+                neighbor = targets[index]
+                candidate = distance + weights[index]
+                if potential is not None:
+                    candidate += potential[current] - potential[neighbor]
+                if candidate < distances[neighbor]:
+                    distances[neighbor] = candidate
+                    heapq.heappush(heap, (candidate, neighbor))
+                    pushes += 1
+                    if parents is not None:
+                        parents[neighbor] = current
+
+        self._record(relaxations, pushes, expanded, peak)
+
+        if potential is not None:
+            # undo the reweighting, every path to v shifted by the same
+            # potential[source] - potential[v]
+            for node, distance in enumerate(distances):
+                if distance != math.inf:
+                    distances[node] = (
+                        distance - potential[source] + potential[node]
+                    )
+        return distances
+
+    def _asDistance(self, value):
+        # tables hold floats to fit inf, weights are integers
+        return math.inf if value == math.inf else int(value)
+
+    """Shortest round trip from a single-source result, the trip has to
+    come back through one of the incoming edges of the source
+    """
+
+    def _roundTrip(self, source: int, distances):
+        roundTrip = math.inf
+        lo, hi = self.reverseOffsets[source], self.reverseOffsets[source + 1]
+        for index in range(lo, hi):
+            candidate = (
+                distances[self.reverseTargets[index]]
+                + self.reverseWeights[index]
+            )
+            if candidate < roundTrip:
+                roundTrip = candidate
+        return self._asDistance(roundTrip)
+
+    """Every distance from source, served from an LRU of the last
+    cacheSize sources so repeated queries from the same origin skip the
+    search altogether
+    """
+
+    def _singleSource(self, source: int):
+        distances = self._sourceCache.get(source)
+        if distances is not None:
+            self._sourceCache.move_to_end(source)
+            return distances
+
+        distances = self._distancesFrom(source)
+        if isinstance(distances, str):
+            return distances  # negative cycle, nothing to keep
+
+        self._sourceCache[source] = distances
+        if len(self._sourceCache) > self.cacheSize:
+            self._sourceCache.popitem(last=False)  # least recently used
+        return distances
+
+    """The shortest route itself, as (length, [stations]).
+
+    Every node remembers the one it was reached from, following those
+    parents back from the destination spells the route. The parents of
+    a source form a tree, the last few trees (at least one, cacheSize
+    when larger) are kept, so more routes from the same origin cost a
+    walk up the tree, O(length of the route).
+    A round trip comes back through the cheapest incoming edge of the
+    source, so it ends in the source once more
+    """
+
+    @_instrumented
+    def findShortestPath(self, source: str, destination: str):
+        if source not in self.nodes or destination not in self.nodes:
+            return "NO SUCH ROUTE"
+        source, destination = self.nodes[source], self.nodes[destination]
+
+        tree = self._shortestPathTree(source)
+        if isinstance(tree, str):
+            return tree  # negative cycle
+        distances, parents = tree
+
+        last, length = destination, distances[destination]
+        if source == destination:
+            length = math.inf
+            lo = self.reverseOffsets[source]
+            for index in range(lo, self.reverseOffsets[source + 1]):
+                u = self.reverseTargets[index]
+                if distances[u] + self.reverseWeights[index] < length:
+                    last, length = u, distances[u] + self.reverseWeights[index]
+        if length == math.inf:
+            return "NO SUCH ROUTE"
+
+        path = [destination] if source == destination else []
+        node = last
+        while node != source:
+            path.append(node)
+            node = parents[node]
+        path.append(source)
+        return length, [self.labels[node] for node in reversed(path)]
+
+    def _shortestPathTree(self, source: int):
+        tree = self._treeCache.get(source)
+        if tree is not None:
+            self._treeCache.move_to_end(source)
+            return tree
+
+        parents = array("q", [-1]) * len(self.labels)
+        if self.nonNegative:
+            distances = self._shortestDistances(source, parents=parents)
+        else:
+            distances = self._labelCorrecting(source, -1, parents)
+            if isinstance(distances, str):
+                return distances  # negative cycle, nothing to keep
+
+        self._treeCache[source] = tree = (distances, parents)
+        if len(self._treeCache) > max(self.cacheSize, 1):
+            self._treeCache.popitem(last=False)  # least recently used
+        return tree
+
+    def _distancesFrom(self, source: int):
+        """Every distance from source with the right engine, uncached"""
+        if self.nonNegative:
+            return self._shortestDistances(source)
+        return self._labelCorrecting(source, -1)
+
+    """One to many, every distance from source (or to each station in
+    'targets') out of a single search instead of one query per
+    destination. The source maps to its shortest round trip, a station
+    it cannot reach to inf. With non-negative weights the search stops
+    as soon as every target is settled
+    """
+
+    @_instrumented
+    def shortestDistancesFrom(self, source: str, targets: list = None):
+        if source not in self.nodes:
+            return "NO SUCH ROUTE"
+        source = self.nodes[source]
+        labels = self.labels if targets is None else list(targets)
+        wanted = {self.nodes[label] for label in labels if label in self.nodes}
+
+        if self._allPairs is not None:
+            distances = [self._asDistance(d) for d in self._allPairs[source]]
+        elif self.cacheSize:
+            distances = self._singleSource(source)
+        elif self.nonNegative and targets is not None:
+            until = set(wanted)
+            if source in until:
+                # the round trip needs every way back in settled
+                until.discard(source)
+                lo = self.reverseOffsets[source]
+                hi = self.reverseOffsets[source + 1]
+                until.update(self.reverseTargets[lo:hi])
+                until.discard(source)
+            distances = (
+                self._shortestDistances(source, until=until) if until
+                else [math.inf] * len(self.labels)  # nothing to look for
+            )
+        else:
+            distances = self._distancesFrom(source)
+        if isinstance(distances, str):
+            return distances  # negative cycle
+
+        row = {}
+        for label in labels:
+            node = self.nodes.get(label)
+            if node is None:
+                row[label] = "NO SUCH ROUTE"
+            elif node == source:
+                row[label] = self._roundTrip(source, distances)
+            else:
+                row[label] = distances[node]
+        return row
+
+    """Reverse queries over the reverse CSR rows: which stations reach
+    'destination', in how few stops or for how little. The station
+    itself maps to its shortest way around and back, like a round trip
+    in findLengthOfShortestPathBetweenTwo. Stations that cannot reach
+    it (or not within 'limit' stops, or not below 'weight') are left
+    out.
+
+    The same reverse searches bound the route counters and generators:
+    a node whose fewest stops (or shortest distance) to the destination
+    do not fit in what is left of the budget is never expanded
+    """
+
+    @_instrumented
+    def fewestStopsTo(self, destination: str, limit: int = None):
+        if destination not in self.nodes:
+            return "NO SUCH ROUTE"
+        destination = self.nodes[destination]
+        hops = self._stopsTo(destination)
+        hops[destination] = 1 + min(
+            (hops[v] for v in self._neighbors(destination)),
+            default=math.inf,
+        )
+        return {
+            self.labels[node]: stops
+            for node, stops in enumerate(hops)
+            if stops != math.inf and (limit is None or stops <= limit)
+        }
+
+    @_instrumented
+    def shortestDistancesTo(self, destination: str, weight: int = None):
+        if destination not in self.nodes:
+            return "NO SUCH ROUTE"
+        destination = self.nodes[destination]
+        distances = self._distancesTo(destination)
+        if isinstance(distances, str):
+            return distances  # negative cycle that reaches destination
+        distances[destination] = self._roundTripTo(destination, distances)
+        return {
+            self.labels[node]: distance
+            for node, distance in enumerate(distances)
+            if distance != math.inf and (weight is None or distance < weight)
+        }
+
+    def _stopsTo(self, destination: int):
+        """Fewest stops from every node to destination, breadth first
+        over the reverse rows, inf when it cannot get there
+        """
+        offsets, targets = self.reverseOffsets, self.reverseTargets
+        hops = [math.inf] * len(self.labels)
+        if destination < 0:
+            return hops  # unknown station, nothing gets there
+        hops[destination] = 0
+        queue = deque([destination])
+        relaxations = 0
+        while queue:
+            current = queue.popleft()
+            relaxations += offsets[current + 1] - offsets[current]
+            for index in range(offsets[current], offsets[current + 1]):
+                neighbor = targets[index]
+                if hops[neighbor] == math.inf:
+                    hops[neighbor] = hops[current] + 1
+                    queue.append(neighbor)
+        self._record(relaxations=relaxations)
+        return hops
+
+    def _distancesTo(self, destination: int, within: bytearray = None):
+        """Every distance to destination over the reverse rows. Negative
+        weights go through the label-correcting search, which only sees
+        the nodes that reach destination (and are in 'within' when
+        given), so a NegativeCycleError means a cycle that reaches it
+        """
+        if self.nonNegative:
+            return self._shortestDistances(destination, reverse=True)
+        return self._labelCorrecting(
+            destination, -1, reverse=True, within=within
+        )
+
+    def _boundsTo(self, source: int, destination: int):
+        """Lower bounds of the weight left from each node on a walk from
+        source to destination. Such a walk never leaves the nodes that
+        source reaches and that reach destination, the distances to
+        destination inside them are exact bounds, inf outside. A
+        NegativeCycleError when a negative cycle lies among them, walks
+        going round it get as light as you like
+        """
+        if self.nonNegative:
+            return self._distancesTo(destination)
+        hops = self._stopsTo(destination)
+        within = bytearray(len(self.labels))
+        if hops[source] == math.inf:
+            return [math.inf] * len(self.labels)
+        within[source] = 1
+        queue = deque([source])
+        relaxations = 0
+        while queue:
+            current = queue.popleft()
+            relaxations += self.offsets[current + 1] - self.offsets[current]
+            for neighbor in self._neighbors(current):
+                if not within[neighbor] and hops[neighbor] != math.inf:
+                    within[neighbor] = 1
+                    queue.append(neighbor)
+        self._record(relaxations=relaxations)
+        return self._distancesTo(destination, within)
+
+    def _roundTripTo(self, node: int, distances: list):
+        # out and back in, the mirror of _roundTrip for distances to node
+        weights, targets = self.weights, self.targets
+        return min(
+            (
+                weights[index] + distances[targets[index]]
+                for index in range(self.offsets[node], self.offsets[node + 1])
+            ),
+            default=math.inf,
+        )
+
+    """The k shortest loopless routes, as [(length, [stations])] from the
+    shortest up, with Yen's algorithm: every next route leaves one of
+    the routes found so far at some spur node, following its root up to
+    there and then the shortest spur that avoids the root and the edges
+    the other routes with the same root took from the spur node.
+
+    Two things keep the spur searches cheap.
+    Lawler: a route that left its parent at node i shares the parent's
+    spurs before i, those were searched already, only i onward is new.
+    The distance from every node to the destination, one reverse search
+    up front over the nodes between source and destination (see
+    _boundsTo), is a potential for every spur search: w(u, v) + d(v) - d(u)
+    is non-negative (with negative weights too, that is the triangle
+    inequality), never lower than the real distance and 0 along the
+    shortest routes, so each spur search is an A* that heads straight
+    down the unrestricted shortest route and only fans out around the
+    banned nodes and edges. Nodes that cannot reach the destination at
+    all are never pushed.
+
+    A round trip (source is destination) is a route to a copy of the
+    source, reached through the incoming edges of the source, so loops
+    back to the start are the only repeated station
+    """
+
+    @_instrumented
+    def findKShortestPaths(self, source: str, destination: str, k: int):
+        if source not in self.nodes or destination not in self.nodes:
+            return "NO SUCH ROUTE"
+        source, destination = self.nodes[source], self.nodes[destination]
+        size = len(self.labels)
+        if k < 1:
+            return []
+
+        potential = self._boundsTo(source, destination)
+        if isinstance(potential, str):
+            return potential  # negative cycle between source and destination
+        home = None
+        target = destination
+        if source == destination:
+            # the copy of the source, distance 0 to itself, the source
+            # itself is as far as its shortest round trip
+            home, target = source, size
+            potential.append(0)
+            potential[source] = self._roundTripTo(source, potential)
+        if potential[source] == math.inf:
+            return []
+
+        def weight(u, v):
+            return self._weight(u, home if v == size else v)
+
+        first = self._spurPath(source, target, home, set(), set(), potential)
+        routes = [(first[0], first[1], 0)]
+        candidates, seen = [], {first[1]}
+        while len(routes) < k:
+            _, path, deviation = routes[-1]
+            rootLength = sum(
+                weight(path[i], path[i + 1]) for i in range(deviation)
+            )
+            # how far every route found so far runs along this one
+            shared = []
+            for (_, other, _) in routes:
+                common = 0
+                for u, v in zip(path, other):
+                    if u != v:
+                        break
+                    common += 1
+                shared.append((common, other))
+            for i in range(deviation, len(path) - 1):
+                bannedEdges = {
+                    (other[i], other[i + 1])
+                    for (common, other) in shared
+                    if common > i and i + 1 < len(other)
+                }
+                spur = self._spurPath(
+                    path[i], target, home, set(path[:i]), bannedEdges,
+                    potential,
+                )
+                if spur is not None:
+                    route = path[:i] + spur[1]
+                    if route not in seen:
+                        seen.add(route)
+                        heapq.heappush(
+                            candidates, (rootLength + spur[0], route, i)
+                        )
+                rootLength += weight(path[i], path[i + 1])
+            if not candidates:
+                break
+            routes.append(heapq.heappop(candidates))
+
+        return [
+            (length, [self.labels[home if v == size else v] for v in path])
+            for (length, path, _) in routes
+        ]
+
+    def _spurPath(
+        self,
+        spur: int,
+        target: int,
+        home: int,
+        bannedNodes: set,
+        bannedEdges: set,
+        potential: list,
+    ):
+        """A* from spur to target on the reduced weights, avoiding the
+        banned nodes and edges. 'home' is the source of a round trip,
+        an edge into it goes to the target (its copy) instead.
+        (length, path tuple) or None
+        """
+        offsets, targets, weights = self.offsets, self.targets, self.weights
+        distances = {spur: 0}
+        parents = {spur: None}
+        settled = set()
+        heap = [(0, spur)]
+        relaxations = pushes = expanded = peak = 0
+        found = None
+
+        while heap:
+            peak = max(peak, len(heap))
+            distance, current = heapq.heappop(heap)
+            if current in settled:
+                continue  # stale entry
+            if current == target:
+                found = distance
+                break
+            settled.add(current)
+            expanded += 1
+            relaxations += offsets[current + 1] - offsets[current]
+
+            for index in range(offsets[current], offsets[current + 1]):
+                neighbor = targets[index]
+                if neighbor == home:
+                    neighbor = target
+                if neighbor in bannedNodes or \
+                   (current, neighbor) in bannedEdges:
+                    continue
+                if potential[neighbor] == math.inf:
+                    continue  # cannot reach the target from there
+                candidate = (
+                    distance + weights[index]
+                    + potential[neighbor] - potential[current]
+                )
+                if candidate < distances.get(neighbor, math.inf):
+                    distances[neighbor] = candidate
+                    parents[neighbor] = current
+                    heapq.heappush(heap, (candidate, neighbor))
+                    pushes += 1
+
+        self._record(relaxations, pushes, expanded, peak)
+        if found is None:
+            return None
+        path = [target]
+        while parents[path[-1]] is not None:
+            path.append(parents[path[-1]])
+        # reduced length back to the real one, the target potential is 0
+        return found + potential[spur], tuple(reversed(path))
+
+    """Johnson's potentials, Bellman-Ford from a virtual node with a 0 edge
+    to every node. w(u, v) + h[u] - h[v] is then non-negative for every
+    edge, and Dijkstra works on graphs with negative edges.
+    None when a negative cycle keeps the potentials from settling
+    """
+
+    def _potentials(self):
+        offsets, targets, weights = self.offsets, self.targets, self.weights
+        size = len(self.labels)
+        potential = [0] * size  # the virtual edges, relaxed up front
+
+        for relax in range(size + 1):
+            changed = False
+            for u in range(size):
+                for index in range(offsets[u], offsets[u + 1]):
+                    v = targets[index]
+                    if potential[u] + weights[index] < potential[v]:
+                        potential[v] = potential[u] + weights[index]
+                        changed = True
+            if not changed:
+                return potential
+
+        return None
+
+    """Dense all-pairs with NumPy, relaxing through every node k in turn
+    touches the whole |V| x |V| table in one vectorised minimum
+    """
+
+    def _floydWarshall(self):
+        size = len(self.labels)
+        table = np.full((size, size), np.inf)
+        degrees = np.diff(np.frombuffer(self.offsets, dtype=np.int64))
+        sources = np.repeat(np.arange(size), degrees)
+        targets = np.frombuffer(self.targets, dtype=np.int64)
+        table[sources, targets] = np.frombuffer(self.weights, dtype=np.int64)
+        # staying put costs nothing, a negative self-loop still shows
+        np.fill_diagonal(table, np.minimum(np.diagonal(table), 0))
+
+        for k in range(size):
+            np.minimum(table, table[:, k, None] + table[None, k, :], out=table)
+
+        if (np.diagonal(table) < 0).any():
+            return None  # a node reaches itself for less than nothing
+        return table
+
+    """Build a distance table between every pair of nodes once, after
+    which findLengthOfShortestPathBetweenTwo is a lookup.
+
+    'method' picks the algorithm, by default Floyd-Warshall for small
+    dense graphs when NumPy is around, repeated Dijkstra for
+    non-negative weights and Johnson's algorithm (reweighting with
+    Bellman-Ford potentials, then repeated Dijkstra) otherwise.
+    The table takes |V|^2 floats, large graphs should use the
+    cacheSize LRU instead. Call again (or clearCache) when edges change
+    """
+
+    @_instrumented
+    def precomputeAllPairs(self, method: str = None):
+        size = len(self.labels)
+        if method is None:
+            dense = len(self.targets) >= (
+                self.FLOYD_WARSHALL_MIN_DENSITY * size * size
+            )
+            if np is not None and dense and \
+               size <= self.FLOYD_WARSHALL_MAX_NODES:
+                method = "floyd-warshall"
+            elif self.nonNegative:
+                method = "dijkstra"
+            else:
+                method = "johnson"
+
+        if method not in self.ALL_PAIRS_METHODS:
+            return f"MethodError {method} is not a valid method"
+
+        if method == "floyd-warshall":
+            if np is None:
+                return "MethodError floyd-warshall needs NumPy"
+            table = self._floydWarshall()
+        else:
+            potential = None
+            if method == "johnson" or not self.nonNegative:
+                potential = self._potentials()
+            if potential is None and not self.nonNegative:
+                table = None
+            else:
+                table = [
+                    array("d", self._shortestDistances(u, potential=potential))
+                    for u in range(size)
+                ]
+
+        if table is None:
+            return "NegativeCycleError: no all-pairs distances exist"
+
+        self._allPairs = table
+        self._roundTrips = array(
+            "d", (self._roundTrip(u, table[u]) for u in range(size))
+        )
+        return None
+
+    def clearCache(self):
+        self._sourceCache.clear()
+        self._treeCache.clear()
+        self._allPairs = None
+        self._roundTrips = None
+
+    """Live changes to the network. The CSR rows stay sorted, so an edge is
+    found with a binary search over its row: changing a weight is
+    O(log degree) in place, adding or removing an edge shifts the arrays
+    behind it (a memmove) and the offsets of the rows after it.
+    Cached distances are repaired or dropped one by one in
+    _invalidate, not thrown away wholesale.
+
+    So an added or removed edge is O(|E| + |V|), not O(1): both are
+    single C loops (the memmove, and a NumPy add over the offsets when
+    NumPy is there), around a millisecond on a network of a million
+    edges. An overlay of pending changes per row would make the change
+    O(1) but cost every relaxation of every query a lookup in it, and
+    queries far outnumber changes on a rail network
+    """
+
+    def addEdge(self, source: str, destination: str, weight: int):
+        self._writable()
+        u, v = self._addNode(source), self._addNode(destination)
+        old = self._weight(u, v)
+        if old is not None:
+            return self.updateWeight(source, destination, weight)
+
+        row = bisect_left(
+            self.targets, v, self.offsets[u], self.offsets[u + 1]
+        )
+        self.targets.insert(row, v)
+        self.weights.insert(row, weight)
+        self._shiftOffsets(self.offsets, u, 1)
+
+        column = bisect_left(
+            self.reverseTargets,
+            u,
+            self.reverseOffsets[v],
+            self.reverseOffsets[v + 1],
+        )
+        self.reverseTargets.insert(column, u)
+        self.reverseWeights.insert(column, weight)
+        self._shiftOffsets(self.reverseOffsets, v, 1)
+
+        self.nonNegative = self.nonNegative and weight >= 0
+        self._invalidate(u, v, None, weight)
+        return None
+
+    def removeEdge(self, source: str, destination: str):
+        row, column = self._edgeIndices(source, destination)
+        if row is None:
+            return "NO SUCH ROUTE"
+        u, v = self.nodes[source], self.nodes[destination]
+        old = self.weights[row]
+
+        self._writable()
+        del self.targets[row]
+        del self.weights[row]
+        self._shiftOffsets(self.offsets, u, -1)
+        del self.reverseTargets[column]
+        del self.reverseWeights[column]
+        self._shiftOffsets(self.reverseOffsets, v, -1)
+
+        if old < 0:
+            self.nonNegative = self._nonNegativeWeights()
+        self._invalidate(u, v, old, None)
+        return None
+
+    def updateWeight(self, source: str, destination: str, weight: int):
+        row, column = self._edgeIndices(source, destination)
+        if row is None:
+            return "NO SUCH ROUTE"
+        old = self.weights[row]
+
+        self._writable()
+        self.weights[row] = weight
+        self.reverseWeights[column] = weight
+
+        if weight < 0:
+            self.nonNegative = False
+        elif old < 0:
+            self.nonNegative = self._nonNegativeWeights()
+        self._invalidate(self.nodes[source], self.nodes[destination], old,
+                         weight)
+        return None
+
+    def _addNode(self, label: str):
+        node = self.nodes.get(label)
+        if node is not None:
+            return node
+
+        node = self._intern(label)
+        # an empty row at the end of both layouts
+        self.offsets.append(self.offsets[-1])
+        self.reverseOffsets.append(self.reverseOffsets[-1])
+        for distances in self._sourceCache.values():
+            distances.append(math.inf)
+        for distances, parents in self._treeCache.values():
+            distances.append(math.inf)
+            parents.append(-1)
+        # the tables have no row nor column for it, build them on demand
+        self._allPairs = None
+        self._roundTrips = None
+        self._landmarks = None
+        self._hierarchy = None
+        self._hopIndex = None
+        return node
+
+    def _edgeIndices(self, source: str, destination: str):
+        """Positions of the edge in the forward and reverse rows"""
+        u, v = self.nodes.get(source), self.nodes.get(destination)
+        if u is None or v is None or self._weight(u, v) is None:
+            return None, None
+        row = bisect_left(
+            self.targets, v, self.offsets[u], self.offsets[u + 1]
+        )
+        column = bisect_left(
+            self.reverseTargets,
+            u,
+            self.reverseOffsets[v],
+            self.reverseOffsets[v + 1],
+        )
+        return row, column
+
+    def _shiftOffsets(self, offsets, node: int, delta: int):
+        # every row after the changed one starts 'delta' further
+        if np is not None:
+            np.frombuffer(offsets, dtype=np.int64)[node + 1:] += delta
+            return
+        for index in range(node + 1, len(offsets)):
+            offsets[index] += delta
+
+    def _nonNegativeWeights(self):
+        if np is not None and len(self.weights):
+            return bool(np.frombuffer(self.weights, dtype=np.int64).min() >= 0)
+        return all(w >= 0 for w in self.weights)
+
+    """Keep cached distances honest after edge u-v went from weight 'old'
+    to 'new' (None when the edge is missing before or after).
+
+    Cheaper (or new) edge: a result only changes if the edge now beats
+    its distance to v. Single-source results are repaired by resuming
+    Dijkstra from v, the all-pairs table by
+        d(x, y) = min(d(x, y), d(x, u) + new + d(v, y))
+    which is exact for a single edge decrease.
+
+    Dearer (or removed) edge: a result only changes if the edge was tight,
+    d(u) + old == d(v), i.e. it may sit on a shortest path. Those
+    single-source results are dropped and those all-pairs rows recomputed,
+    every other result is still exact.
+
+    Shortest path trees work the same, except a dearer edge only matters
+    when it is the tree edge into v, a tight edge off the tree leaves
+    every route in the tree as short as it was.
+
+    Negative weights give no such guarantees (a cheaper edge may close a
+    negative cycle), affected results are dropped instead.
+
+    Landmark distances of a dearer edge are still lower bounds (every
+    real distance only grew) and stay, a cheaper edge drops them.
+    The contraction hierarchy is dropped either way, its shortcuts and
+    witnesses are all built on the old weights
+    """
+
+    def _invalidate(self, u: int, v: int, old, new):
+        old = math.inf if old is None else old
+        new = math.inf if new is None else new
+        if new == old:
+            return
+        cheaper = new < old
+        if cheaper:
+            self._landmarks = None
+        self._hierarchy = None
+        self._hopIndex = None
+
+        for source, distances in list(self._sourceCache.items()):
+            if distances[u] == math.inf:
+                continue  # the edge is out of reach from this source
+            if cheaper and distances[u] + new < distances[v]:
+                if self.nonNegative:
+                    self._repair(distances, v, distances[u] + new)
+                else:
+                    del self._sourceCache[source]
+            elif not cheaper and distances[u] + old == distances[v]:
+                del self._sourceCache[source]
+
+        for source, (distances, parents) in list(self._treeCache.items()):
+            if distances[u] == math.inf:
+                continue
+            if cheaper and distances[u] + new < distances[v]:
+                if self.nonNegative:
+                    parents[v] = u
+                    self._repair(distances, v, distances[u] + new, parents)
+                else:
+                    del self._treeCache[source]
+            elif not cheaper and parents[v] == u:
+                del self._treeCache[source]
+
+        if self._allPairs is None:
+            return
+        table, size = self._allPairs, len(self.labels)
+        if cheaper:
+            if table[v][u] + new < 0:
+                self._allPairs = self._roundTrips = None  # negative cycle
+                return
+            if isinstance(table, list):
+                for x in range(size):
+                    throughEdge = table[x][u] + new
+                    if throughEdge >= table[x][v]:
+                        continue
+                    row, tail = table[x], table[v]
+                    for y in range(size):
+                        if throughEdge + tail[y] < row[y]:
+                            row[y] = throughEdge + tail[y]
+            else:  # NumPy table from Floyd-Warshall, same in one go
+                np.minimum(
+                    table, table[:, u, None] + new + table[None, v, :],
+                    out=table,
+                )
+        else:
+            for x in range(size):
+                if table[x][u] == math.inf or table[x][u] + old != table[x][v]:
+                    continue
+                if not self.nonNegative:
+                    self._allPairs = self._roundTrips = None
+                    return
+                table[x][:] = array("d", self._shortestDistances(x))
+
+        # incoming edges (and distances) changed, refresh the way back
+        self._roundTrips = array(
+            "d", (self._roundTrip(x, table[x]) for x in range(size))
+        )
+
+    def _repair(
+        self, distances: list, node: int, distance, parents: array = None
+    ):
+        """Resume Dijkstra from a node whose distance just dropped"""
+        offsets, targets, weights = self.offsets, self.targets, self.weights
+        distances[node] = distance
+        heap = [(distance, node)]
+        while heap:
+            distance, current = heapq.heappop(heap)
+            if distance > distances[current]:
+                continue  # stale entry
+            for index in range(offsets[current], offsets[current + 1]):
+                neighbor = targets[index]
+                candidate = distance + weights[index]
+                if candidate < distances[neighbor]:
+                    distances[neighbor] = candidate
+                    heapq.heappush(heap, (candidate, neighbor))
+                    if parents is not None:
+                        parents[neighbor] = current
+
+    """Memoized count of walks below a weight budget.
+
+    count(u, r) is the number of walks from u that end in destination
+    and weigh less than r, the empty walk included when u is the
+    destination:
+        count(u, r) = [u == destination] + sum count(v, r - w)
+    over the edges u-v with w < r. Many walks share the same tail, so
+    each (node, remaining) state is solved once and reused, the answer
+    never enumerates a path.
+
+    The shortest distance from v to the destination (see _boundsTo)
+    is a lower bound of any walk from v, a state whose
+    bound is not below its remaining budget counts 0 and is never
+    pushed, so the search stays inside the useful corridor.
+
+    Iterative post-order DFS, budgets of a few thousand would blow the
+    recursion limit. A state met again while still on the stack is a
+    zero weight cycle within budget, and a negative cycle lets the budget
+    grow forever, either way the count is unbounded and we return inf
+    """
+
+    def _countWalksBelowWeight(
+        self, source: int, destination: int, weight: int
+    ):
+        offsets, targets, weights = self.offsets, self.targets, self.weights
+
+        bound = self._boundsTo(source, destination)
+        if isinstance(bound, str):
+            return math.inf  # negative cycle between source and destination
+
+        def expand(state):
+            current, remaining = state
+            following = []
+            for index in range(offsets[current], offsets[current + 1]):
+                neighbor = targets[index]
+                left = remaining - weights[index]
+                # there's still some 'gas left in the tank' to get there
+                if bound[neighbor] < left:
+                    following.append((neighbor, left))
+            return iter(following)
+
+        memo = {}
+        root = (source, weight)
+        onStack = {root}
+        stack = [[root, expand(root), int(source == destination)]]
+        relaxations, pushes, peak = 0, 1, 1
+        while stack:
+            frame = stack[-1]
+            for state in frame[1]:
+                if state in memo:
+                    frame[2] += memo[state]
+                    continue
+                if state in onStack:
+                    self._record(relaxations, pushes, len(memo), peak)
+                    return math.inf
+                onStack.add(state)
+                stack.append(
+                    [state, expand(state), int(state[0] == destination)]
+                )
+                pushes += 1
+                peak = max(peak, len(stack))
+                break
+            else:  # every child counted, fold into the parent
+                stack.pop()
+                onStack.discard(frame[0])
+                memo[frame[0]] = frame[2]
+                current = frame[0][0]
+                relaxations += offsets[current + 1] - offsets[current]
+                if stack:
+                    stack[-1][2] += frame[2]
+
+        self._record(relaxations, pushes, len(memo), peak)
+        # a trip has at least one stop, the empty one does not count
+        return memo[root] - int(source == destination)
+
+    @_instrumented
+    def countAllUniquePathsBelowWeight(
+        self,
+        source: str,
+        destination: str,
+        weight: int,
+    ):
+        if not set([source, destination]) <= set(self.nodes):
+            return "NO SUCH ROUTE"
+
+        return self._countWalksBelowWeight(
+            self.nodes[source], self.nodes[destination], weight
+        )
+
+    """Lazy depth first walk enumeration, the building block of the
+    iterRoutes* generators.
+
+    A walk is extended one edge at a time while its cost stays within
+    'highest' (stops or weight, depending on useWeights), and yielded
+    when it sits on the destination, with exact=True only when its cost
+    is exactly 'highest'. Only the current walk is kept: path, costs and
+    cursors (the next CSR edge to try at each depth) grow and shrink by
+    one entry per step, memory is O(depth) and no list is ever copied
+    except for the route handed to the caller.
+
+    'bound' is a lower bound of the cost left to reach the destination
+    from a node, branches that cannot make it are skipped. Walks are cut
+    at 'depth' edges when given, see iterRoutesBelowWeight. 'deadline'
+    is a time.monotonic() timestamp, the generator just stops when it
+    is reached. Closing the generator cancels the search.
+    """
+
+    def _iterWalks(
+        self,
+        source: int,
+        destination: int,
+        highest: int,
+        exact: bool,
+        useWeights: bool,
+        bound: list,
+        deadline: float = None,
+        depth: int = None,
+    ):
+        offsets, targets, weights = self.offsets, self.targets, self.weights
+        path = [source]
+        costs = [0]
+        cursors = [offsets[source]]
+
+        while cursors:
+            if deadline is not None and time.monotonic() >= deadline:
+                return
+            current = path[-1]
+            index = cursors[-1]
+            if index == offsets[current + 1]:
+                # every edge of this node tried, back to its parent
+                path.pop()
+                costs.pop()
+                cursors.pop()
+                continue
+            cursors[-1] = index + 1
+
+            neighbor = targets[index]
+            cost = costs[-1] + (weights[index] if useWeights else 1)
+            if cost + bound[neighbor] > highest:
+                continue
+            if depth is not None and len(path) > depth:
+                continue  # round a zero weight cycle once too often
+
+            path.append(neighbor)
+            costs.append(cost)
+            cursors.append(offsets[neighbor])
+            if neighbor == destination and (not exact or cost == highest):
+                yield [self.labels[node] for node in path]
+
+    """Generator versions of findAllPathsWithLimit and
+    countAllUniquePathsBelowWeight for when the routes themselves are
+    needed but may not fit in memory. Routes come out depth first, at
+    most maxResults of them and none after 'deadline' (a
+    time.monotonic() timestamp). They return iterators, so errors are
+    raised as ValueError rather than returned as strings, which would
+    iterate one character at a time.
+
+    Below a weight, a negative cycle between source and destination
+    makes routes as light as you like, we raise ValueError with its
+    NegativeCycleError instead of walking round it forever (the
+    stations are in error.args[0].cycle). A zero weight cycle gives
+    infinitely many routes too, and depth first they would never come
+    out, so walks are cut at a depth no route without one reaches: on
+    the weights reduced by the bounds (w(u, v) + b(v) - b(u), integers
+    and never negative) a route spends at most the slack
+    weight - 1 - b(source) on edges of reduced weight 1 or more, and
+    between two of them runs fewer than |V| edges of reduced weight 0
+    unless it repeats a station along a zero weight cycle
+    """
+
+    def iterRoutesWithLimit(
+        self,
+        source: str,
+        destination: str,
+        limit: int,
+        notation: str = None,
+        maxResults: int = None,
+        deadline: float = None,
+    ):
+        if not self._validateNotation(notation):
+            raise ValueError(
+                f"NotationError {notation} is not a valid notation"
+            )
+
+        if source not in self.nodes or destination not in self.nodes:
+            return iter(())
+
+        highest = limit - 1 if notation == "<" else limit
+        routes = self._iterWalks(
+            self.nodes[source],
+            self.nodes[destination],
+            highest,
+            notation == "==",
+            False,
+            self._stopsTo(self.nodes[destination]),
+            deadline,
+        )
+        return islice(routes, maxResults)
+
+    def iterRoutesBelowWeight(
+        self,
+        source: str,
+        destination: str,
+        weight: int,
+        maxResults: int = None,
+        deadline: float = None,
+    ):
+        if source not in self.nodes or destination not in self.nodes:
+            return iter(())
+        source, destination = self.nodes[source], self.nodes[destination]
+
+        bound = self._boundsTo(source, destination)
+        if isinstance(bound, str):
+            # negative cycle between source and destination
+            raise ValueError(bound)
+        if bound[source] == math.inf:
+            return iter(())
+
+        # weights are integers, below 'weight' is at most 'weight - 1'
+        slack = weight - 1 - bound[source]
+        corridor = sum(1 for distance in bound if distance != math.inf)
+        routes = self._iterWalks(
+            source, destination, weight - 1, False, True, bound, deadline,
+            max(slack + 1, 0) * corridor,
+        )
+        return islice(routes, maxResults)
+
+    """Batches for reports that ask the same thing from many origins,
+    sharded over a pool of 'workers' processes (one per CPU by default,
+    workers=1 stays in this process). The network goes to each worker
+    once, as the compact payload of _payload handed to the pool
+    initializer, or as the path of the snapshot the graph was saved to or
+    loaded from, which workers map instead of copying, while that path is
+    still the same file (see _sharedSnapshot). Tasks only carry labels.
+    Results come back in the order of the input.
+
+    batchShortest gives, per source, a dict of every station (or of
+    'destinations') to its shortest distance, the source itself mapping
+    to its shortest round trip. batchCountRoutes gives the
+    countAllUniquePathsWithLimitByBFS answer of every (source,
+    destination) pair
+    """
+
+    def batchShortest(
+        self,
+        sources: Iterable[str],
+        destinations: Iterable[str] = None,
+        workers: int = None,
+    ):
+        if destinations is not None:
+            destinations = list(destinations)
+        task = partial(_shortestRow, destinations=destinations)
+        return self._batch(task, list(sources), workers)
+
+    def batchCountRoutes(
+        self,
+        pairs: Iterable[tuple],
+        limit: int,
+        notation: str = None,
+        workers: int = None,
+    ):
+        if not self._validateNotation(notation):
+            return f"NotationError {notation} is not a valid notation"
+        task = partial(_countRoutes, limit=limit, notation=notation)
+        return self._batch(task, list(pairs), workers)
+
+    def _batch(self, task, items: list, workers: int = None):
+        workers = workers or os.cpu_count() or 1
+        if workers == 1 or len(items) < 2:
+            return [task(item, graph=self) for item in items]
+
+        snapshot = self._sharedSnapshot()
+        # a few chunks per worker, small enough to balance the load
+        chunksize = max(1, len(items) // (4 * workers))
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_startWorker,
+            initargs=(None, snapshot) if snapshot else (self._payload(),),
+        ) as executor:
+            return list(executor.map(task, items, chunksize=chunksize))
+
+    def _sharedSnapshot(self):
+        """(path, identity) of the snapshot, None unless the file at path
+        is still the one the rows came from
+        """
+        if self._snapshot is None:
+            return None
+        path, identity = self._snapshot
+        try:
+            current = _fileIdentity(os.stat(path))
+        except OSError:
+            return None  # removed since
+        return self._snapshot if current == identity else None
+
+    """Compact form of the network for other processes, the labels as one
+    NUL separated UTF-8 blob and the CSR rows as raw machine integers,
+    nothing per edge to pickle. The reverse rows are rebuilt on arrival
+    """
+
+    def _payload(self):
+        return (
+            "\0".join(self.labels).encode("utf-8"),
+            self.offsets.tobytes(),
+            self.targets.tobytes(),
+            self.weights.tobytes(),
+        )
+
+    @classmethod
+    def _fromPayload(cls, payload, **kwargs):
+        labels, offsets, targets, weights = payload
+        graph = cls(**kwargs)
+        graph.labels = labels.decode("utf-8").split("\0") if labels else []
+        graph.nodes = {label: node for node, label in enumerate(graph.labels)}
+        graph.offsets, graph.targets, graph.weights = (
+            array("q", offsets), array("q", targets), array("q", weights)
+        )
+        graph._compileReverse()
+        graph.nonNegative = all(w >= 0 for w in graph.weights)
+        return graph
+
+
+"""Batch workers, module level so the pool can pickle them by name.
+Each worker process rebuilds the graph once from its payload (or maps
+its snapshot) and keeps it in _worker for every task it gets. A
+snapshot replaced between _sharedSnapshot and the worker mapping it
+fails the batch rather than answering for another network
+"""
+
+_worker = None
+
+
+def _startWorker(payload, snapshot=None):
+    global _worker
+    if snapshot is None:
+        _worker = Graph._fromPayload(payload)
+        return
+    path, identity = snapshot
+    _worker = Graph.load(path)
+    if _worker._snapshot[1] != identity:
+        raise ValueError(f"{path} was replaced while the batch started")
+
+
+def _fileIdentity(stat):
+    return stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def _shortestRow(source: str, destinations: list = None, graph=None):
+    graph = graph or _worker
+    return graph.shortestDistancesFrom(source, destinations)
+
+
+def _countRoutes(pair: tuple, limit: int, notation: str = None, graph=None):
+    graph = graph or _worker
+    source, destination = pair
+    return graph.countAllUniquePathsWithLimitByBFS(
+        source, destination, limit, notation
+    )
+
+
+"""asyncio facade for services. Graph queries are CPU bound and
+synchronous, here they run on an executor so the event loop keeps
+serving, and identical queries in flight at the same time share one
+computation: the second caller awaits the future of the first instead
+of starting its own.
+
+Shortest distances are shared per origin, not per (origin,
+destination): the first query from A computes every distance from A
+once and every query from A waiting meanwhile, whatever its
+destination, reads its answer off that one result.
+
+The default executor has a single thread. Graph caches are not thread
+safe and the GIL runs one search at a time anyway, one thread also
+keeps live changes in order with the queries queued before them.
+A shared executor should be thread based as well, a process pool would
+pickle the whole graph on every call
+"""
+
+
+class AsyncGraph:
+    def __init__(self, graph: Graph, executor=None):
+        self.graph = graph
+        self._ownExecutor = executor is None
+        self.executor = executor or ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="pathfinder"
+        )
+        self._inFlight = {}  # query key -> future of its result
+
+    def close(self):
+        if self._ownExecutor:
+            self.executor.shutdown(wait=False)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    async def _coalesced(self, key: tuple, query, *args):
+        future = self._inFlight.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self.executor, query, *args)
+            self._inFlight[key] = future
+            future.add_done_callback(partial(self._landed, key))
+        # a cancelled caller must not cancel the others waiting on it
+        return await asyncio.shield(future)
+
+    def _origin(self, source: int):
+        """Every distance from source and its round trip, runs on the
+        executor. A precomputed table or the LRU of the graph is used
+        when there is one
+        """
+        graph = self.graph
+        if graph._allPairs is not None:
+            distances = [graph._asDistance(d) for d in graph._allPairs[source]]
+            return distances, graph._asDistance(graph._roundTrips[source])
+        if graph.cacheSize:
+            distances = graph._singleSource(source)
+        else:
+            distances = graph._distancesFrom(source)
+        if isinstance(distances, str):
+            return distances, distances  # negative cycle
+        return distances, graph._roundTrip(source, distances)
+
+    def _landed(self, key: tuple, future):
+        # a live change may have put a newer future under the same key
+        if self._inFlight.get(key) is future:
+            del self._inFlight[key]
+
+    async def findLengthOfShortestPathBetweenTwo(
+        self, source: str, destination: str
+    ):
+        nodes = self.graph.nodes
+        if source not in nodes or destination not in nodes:
+            return "NO SUCH ROUTE"
+        source, destination = nodes[source], nodes[destination]
+
+        distances, roundTrip = await self._coalesced(
+            ("origin", source), self._origin, source
+        )
+        if source == destination:
+            return roundTrip
+        if isinstance(distances, str):
+            return distances
+        return distances[destination]
+
+    async def _query(self, name: str, *args):
+        # paths may come as lists, the key has to be hashable
+        key = (name,) + tuple(
+            tuple(arg) if isinstance(arg, list) else arg for arg in args
+        )
+        return await self._coalesced(key, getattr(self.graph, name), *args)
+
+    async def findShortestPath(self, source: str, destination: str):
+        return await self._query("findShortestPath", source, destination)
+
+    async def computeExactPathDistance(self, path):
+        return await self._query("computeExactPathDistance", path)
+
+    async def countAllUniquePathsWithLimitByBFS(
+        self, source: str, destination: str, limit: int, notation: str = None
+    ):
+        return await self._query(
+            "countAllUniquePathsWithLimitByBFS",
+            source, destination, limit, notation,
+        )
+
+    async def findAllPathsWithLimit(
+        self, source: str, destination: str, limit: int, notation: str = None
+    ):
+        return await self._query(
+            "findAllPathsWithLimit", source, destination, limit, notation
+        )
+
+    async def countAllUniquePathsBelowWeight(
+        self, source: str, destination: str, weight: int
+    ):
+        return await self._query(
+            "countAllUniquePathsBelowWeight", source, destination, weight
+        )
+
+    """Live changes go through the same executor, after the queries
+    already queued. Queries arriving from now on must see the change, so
+    they no longer join the computations in flight
+    """
+
+    async def _change(self, name: str, *args):
+        self._inFlight.clear()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, getattr(self.graph, name), *args
+        )
+
+    async def addEdge(self, source: str, destination: str, weight: int):
+        return await self._change("addEdge", source, destination, weight)
+
+    async def removeEdge(self, source: str, destination: str):
+        return await self._change("removeEdge", source, destination)
+
+    async def updateWeight(self, source: str, destination: str, weight: int):
+        return await self._change("updateWeight", source, destination, weight)
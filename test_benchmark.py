@@ -0,0 +1,67 @@
+from benchmark import DENSE_MAX_NODES, GENERATORS, run
+from pathfinder import Graph
+
+"""Unit tests for benchmark.py, the generators have to be reproducible
+and the right size, the runner has to emit one record per query
+"""
+
+
+def test_generators_are_seeded():
+    for name, generator in GENERATORS.items():
+        first = list(generator(1000, seed=7))
+        second = list(generator(1000, seed=7))
+        other = list(generator(1000, seed=8))
+
+        assert first == second, name
+        assert first != other, name
+        assert 500 <= len(first) <= 1500, name
+
+
+def test_generators_negative_weights_without_negative_cycle():
+    for name, generator in GENERATORS.items():
+        g = Graph(generator(300, seed=3, negative=True))
+
+        assert not g.nonNegative, name
+        # Johnson's potentials only exist without a negative cycle
+        assert g.precomputeAllPairs("johnson") is None, name
+
+
+def test_run_emits_one_record_per_query():
+    records = list(run(
+        [10, 100],
+        ["chain"],
+        ["findLengthOfShortestPathBetweenTwo", "Graph"],
+        repeats=1,
+    ))
+
+    assert [record["method"] for record in records] == [
+        "Graph", "findLengthOfShortestPathBetweenTwo",
+    ] * 2
+    for record in records:
+        assert record["median_s"] >= 0
+        assert record["peak_bytes"] >= 0
+
+
+def test_run_covers_every_public_method():
+    records = list(run([10], ["scale-free"], repeats=1))
+    # constructors and housekeeping, timed through "Graph" or not at all
+    untimed = {"clearCache", "fromFile", "fromIterable"}
+    public = {
+        name for name in dir(Graph)
+        if not name.startswith("_") and callable(getattr(Graph, name))
+    }
+
+    timed = {
+        name for record in records for name in record["method"].split("/")
+    }
+    assert timed == public - untimed | {"Graph"}
+    assert not any(record.get("skipped") for record in records)
+
+
+def test_run_skips_dense_counts_on_large_networks():
+    records = list(run(
+        [1650], ["scale-free"], ["countAllRoutesWithLimit"], repeats=1
+    ))
+
+    assert records[0]["nodes"] > DENSE_MAX_NODES
+    assert records[0]["skipped"]
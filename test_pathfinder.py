@@ -1,4 +1,12 @@
-from pathfinder import Graph
+import asyncio
+import logging
+import math
+import os
+import time
+
+import pytest
+
+from pathfinder import AsyncGraph, Graph, NegativeCycleError
 
 """Unit tests for pathfinder.py
 
@@ -158,6 +166,74 @@ def test_computeExactPathDistance_large():
     assert distance == scenario["expected"]
 
 
+def test_computeExactPathDistances_batch():
+    scenario = {  # 1 - 5
+        "edges": [
+            "AB5", "BC4", "CD8", "DC8",
+            "DE6", "AD5", "CE2", "EB3",
+            "AE7",
+        ],
+        "paths": ["ABC", "AD", "ADC", "AEBCD", "AED", "", ["A", "B"]],
+        "expected": [9, 5, 13, 22, "NO SUCH ROUTE", 0, 5],
+    }
+    g = Graph(scenario["edges"])
+    distances = g.computeExactPathDistances(scenario["paths"])
+
+    assert len(distances) == len(scenario["expected"])
+    for distance, expected in zip(distances, scenario["expected"]):
+        if expected == "NO SUCH ROUTE":
+            assert math.isnan(distance)
+        else:
+            assert distance == expected
+
+
+def test_computeExactPathDistances_node_ids():
+    np = pytest.importorskip("numpy")
+    scenario = {
+        "edges": [
+            "AB5", "BC4", "CD8", "DC8",
+            "DE6", "AD5", "CE2", "EB3",
+            "AE7",
+        ],
+        # A-B-C, A-E-B-C and A-E-D, -1 pads the shorter routes
+        "paths": [["A", "B", "C"], ["A", "E", "B", "C"], ["A", "E", "D"]],
+        "expected": [9, 14, math.nan],
+    }
+    g = Graph(scenario["edges"])
+    routes = np.full((3, 4), -1)
+    for row, path in enumerate(scenario["paths"]):
+        routes[row, :len(path)] = [g.nodes[label] for label in path]
+
+    for dense in [True, False]:
+        g.DENSE_GATHER_MAX_NODES = len(g.labels) if dense else 0
+        distances = g.computeExactPathDistances(routes)
+        np.testing.assert_array_equal(distances, scenario["expected"])
+
+
+def test_computeExactPathDistances_after_changes():
+    np = pytest.importorskip("numpy")
+    scenario = {
+        "edges": ["AB5", "BC4", "CD8", "DC8", "DE6", "AD5", "AE7"],
+        "paths": [["A", "B", "C"], ["A", "E", "D"], ["A", "F"]],
+        # (change, expected) in order, the hop weights are kept between
+        "changes": [
+            (None, [9, math.nan, math.nan]),
+            (("updateWeight", "B", "C", 1), [6, math.nan, math.nan]),
+            (("addEdge", "E", "D", 2), [6, 9, math.nan]),
+            (("addEdge", "A", "F", 3), [6, 9, 3]),
+            (("removeEdge", "A", "B"), [math.nan, 9, 3]),
+        ],
+    }
+    for dense in [True, False]:
+        g = Graph(scenario["edges"])
+        g.DENSE_GATHER_MAX_NODES = 1024 if dense else 0
+        for change, expected in scenario["changes"]:
+            if change is not None:
+                getattr(g, change[0])(*change[1:])
+            distances = g.computeExactPathDistances(scenario["paths"])
+            np.testing.assert_array_equal(distances, expected)
+
+
 """Assignment 2: All unique paths for node to node,
 aka search algorithm
 
@@ -343,7 +419,10 @@ def test_countAllUniquePathsWithLimitByBFS_less():
         "destination": "C",
         "notation": '<',
         "limit": 30,
-        "expected": 3881,
+        # every walk of 1 to 29 stops, the old BFS reported 3881 because
+        # it reset the path after each hit and then deduplicated the
+        # truncated paths of later walks against each other
+        "expected": 74592,
     }
     g = Graph(scenario["edges"])
     pathsCount = g.countAllUniquePathsWithLimitByBFS(
@@ -378,7 +457,131 @@ def test_countAllUniquePathsWithLimitByBFS_equal():
     assert pathsCount == scenario["expected"]
 
 
+def test_findAllPathsWithLimit_less_or_equal_to():
+    scenario = {  # 6
+        "edges": [
+            "AB5", "BC4", "CD8", "DC8",
+            "DE6", "AD5", "CE2", "EB3",
+            "AE7",
+        ],
+        "source": "C",
+        "destination": "C",
+        "notation": '<=',
+        "limit": 3,
+        "expected": [["C", "D", "C"], ["C", "E", "B", "C"]],
+    }
+    g = Graph(scenario["edges"])
+    paths = g.findAllPathsWithLimit(
+        scenario["source"],
+        scenario["destination"],
+        scenario["limit"],
+        scenario["notation"],
+    )
+    assert paths == scenario["expected"]
+
+
+def test_findAllPathsWithLimit_equal():
+    scenario = {  # 7
+        "edges": [
+            "AB5", "BC4", "CD8", "DC8",
+            "DE6", "AD5", "CE2", "EB3",
+            "AE7",
+        ],
+        "source": "A",
+        "destination": "C",
+        "notation": "==",
+        "limit": 4,
+        "expected": [
+            ["A", "B", "C", "D", "C"],
+            ["A", "D", "C", "D", "C"],
+            ["A", "D", "E", "B", "C"],
+        ],
+    }
+    g = Graph(scenario["edges"])
+    paths = g.findAllPathsWithLimit(
+        scenario["source"],
+        scenario["destination"],
+        scenario["limit"],
+        scenario["notation"],
+    )
+    assert sorted(paths) == scenario["expected"]
+
+
 # Assignment 3
+
+
+def test_countAllRoutesWithLimit():
+    scenario = {  # 6, 7
+        "edges": [
+            "AB5", "BC4", "CD8", "DC8",
+            "DE6", "AD5", "CE2", "EB3",
+            "AE7",
+        ],
+        "queries": [
+            ("C", "C", 3, "<="), ("A", "C", 4, "=="), ("A", "C", 4, "<"),
+        ],
+        "expected": [2, 3, 3],
+    }
+    g = Graph(scenario["edges"])
+    for source, destination, limit, notation in scenario["queries"]:
+        table = g.countAllRoutesWithLimit(limit, notation)
+        assert table[g.nodes[source]][g.nodes[destination]] == \
+            g.countAllUniquePathsWithLimitByBFS(
+                source, destination, limit, notation
+            )
+    counts = [
+        g.countAllRoutesWithLimit(limit, notation)[g.nodes[source]][
+            g.nodes[destination]
+        ]
+        for (source, destination, limit, notation) in scenario["queries"]
+    ]
+    assert counts == scenario["expected"]
+
+
+def test_countAllRoutesWithLimit_large_limit(monkeypatch):
+    scenario = {
+        "edges": ["AB1", "BA1", "BC1", "CA1"],
+        "limit": 200,
+        "modulus": 1000000007,
+    }
+    g = Graph(scenario["edges"])
+    exact = g._countWalksWithLimit(0, 0, scenario["limit"], "<=")
+    assert exact > 2 ** 63  # no int64 would hold it
+    assert g.countAllRoutesWithLimit(scenario["limit"], "<=")[0][0] == exact
+    assert g.countAllRoutesWithLimit(
+        scenario["limit"], "<=", scenario["modulus"]
+    )[0][0] == exact % scenario["modulus"]
+    # same products on lists without NumPy
+    monkeypatch.setattr("pathfinder.np", None)
+    assert g.countAllRoutesWithLimit(scenario["limit"], "<=")[0][0] == exact
+
+
+def test_countRoutesFrom():
+    scenario = {  # 6
+        "edges": [
+            "AB5", "BC4", "CD8", "DC8",
+            "DE6", "AD5", "CE2", "EB3",
+            "AE7",
+        ],
+        "source": "C",
+        "limit": 3,
+        "notation": "<=",
+        "expected": {"A": 0, "B": 2, "C": 2, "D": 2, "E": 3},
+    }
+    g = Graph(scenario["edges"])
+    counts = g.countRoutesFrom(
+        scenario["source"], scenario["limit"], scenario["notation"]
+    )
+    assert counts == scenario["expected"]
+    for destination, count in counts.items():
+        assert count == g.countAllUniquePathsWithLimitByBFS(
+            scenario["source"],
+            destination,
+            scenario["limit"],
+            scenario["notation"],
+        )
+
+
 """Assignment 3: Find shortest path between two,
 aka dijkstra's / bellman-ford.
 
@@ -492,6 +695,407 @@ def test_findLengthOfShortestPathBetweenTwo_many_paths():
     assert distance == scenario["expected"]
 
 
+def test_findLengthOfShortestPathBetweenTwo_multi_digit_weights():
+    scenario = {
+        "edges": ["AB12", "BC30", "AC50"],
+        "source": "A",
+        "destination": "C",
+        "expected": 42,
+    }
+    g = Graph(scenario["edges"])
+    distance = g.findLengthOfShortestPathBetweenTwo(
+        scenario["source"],
+        scenario["destination"],
+    )
+    assert g.nonNegative
+    assert distance == scenario["expected"]
+
+
+def test_findLengthOfShortestPathBetweenTwo_negative_weight():
+    scenario = {
+        "edges": ["AB5", "AC2", "CB-1"],
+        "source": "A",
+        "destination": "B",
+        "expected": 1,
+    }
+    g = Graph(scenario["edges"])
+    distance = g.findLengthOfShortestPathBetweenTwo(
+        scenario["source"],
+        scenario["destination"],
+    )
+    assert not g.nonNegative  # falls back to Bellman-Ford
+    assert distance == scenario["expected"]
+
+
+def test_findLengthOfShortestPathBetweenTwo_all_pairs():
+    scenario = {  # 8, 9
+        "edges": [
+            "AB5", "BC4", "CD8", "DC8",
+            "DE6", "AD5", "CE2", "EB3",
+            "AE7",
+        ],
+        "queries": [("A", "C"), ("B", "B"), ("C", "A")],
+        "expected": [9, 9, math.inf],
+    }
+    for method in ["dijkstra", "johnson"]:
+        g = Graph(scenario["edges"])
+        g.precomputeAllPairs(method)
+        distances = [
+            g.findLengthOfShortestPathBetweenTwo(source, destination)
+            for (source, destination) in scenario["queries"]
+        ]
+        assert distances == scenario["expected"]
+
+
+def test_findLengthOfShortestPathBetweenTwo_all_pairs_floyd_warshall():
+    pytest.importorskip("numpy")
+    scenario = {
+        "edges": ["AB5", "AC2", "CB-1", "BA4"],
+        "queries": [("A", "B"), ("B", "C"), ("A", "A")],
+        "expected": [1, 6, 5],
+    }
+    g = Graph(scenario["edges"])
+    g.precomputeAllPairs("floyd-warshall")
+    distances = [
+        g.findLengthOfShortestPathBetweenTwo(source, destination)
+        for (source, destination) in scenario["queries"]
+    ]
+    assert distances == scenario["expected"]
+
+
+def test_all_pairs_floyd_warshall_negative_self_loop():
+    pytest.importorskip("numpy")
+    scenario = {
+        "edges": ["AB5", "BB-1", "BC2"],
+        "expected": "NegativeCycleError: no all-pairs distances exist",
+    }
+    g = Graph(scenario["edges"])
+    assert g.precomputeAllPairs("floyd-warshall") == scenario["expected"]
+    assert isinstance(
+        g.findLengthOfShortestPathBetweenTwo("A", "C"), NegativeCycleError
+    )
+
+
+def test_findLengthOfShortestPathBetweenTwo_source_cache():
+    scenario = {
+        "edges": [
+            "AB5", "BC4", "CD8", "DC8",
+            "DE6", "AD5", "CE2", "EB3",
+            "AE7",
+        ],
+        "queries": [("A", "C"), ("B", "B"), ("A", "E"), ("C", "B")],
+        "expected": [9, 9, 7, 5],
+        "cached": ["A", "C"],
+    }
+    g = Graph(scenario["edges"], cacheSize=2)
+    distances = [
+        g.findLengthOfShortestPathBetweenTwo(source, destination)
+        for (source, destination) in scenario["queries"]
+    ]
+    assert distances == scenario["expected"]
+    # B was the least recently used origin when C came in
+    assert [g.labels[node] for node in g._sourceCache] == scenario["cached"]
+
+
+def test_findLengthOfShortestPathBetweenTwo_point_to_point_methods():
+    scenario = {
+        "edges": [
+            "AB5", "BC4", "CD8", "DC8",
+            "DE6", "AD5", "CE2", "EB3",
+            "AE7",
+        ],
+        "methods": ["bellman-ford", "bidirectional", "alt", "hierarchy"],
+    }
+    g = Graph(scenario["edges"])
+    for source in g.labels:
+        for destination in g.labels:
+            expected = g.findLengthOfShortestPathBetweenTwo(
+                source, destination, "dijkstra"
+            )
+            for method in scenario["methods"]:
+                distance = g.findLengthOfShortestPathBetweenTwo(
+                    source, destination, method
+                )
+                assert distance == expected, (source, destination, method)
+    assert g._landmarks is not None
+
+
+def test_findLengthOfShortestPathBetweenTwo_method_errors():
+    scenario = {
+        "edges": ["AB5", "AC2", "CB-1"],
+        "expected": {
+            "astar": "MethodError astar is not a valid method",
+            "alt": "MethodError alt needs non-negative weights",
+            "bellman-ford": 1,
+        },
+    }
+    g = Graph(scenario["edges"])
+    for method, expected in scenario["expected"].items():
+        assert g.findLengthOfShortestPathBetweenTwo("A", "B", method) == \
+            expected
+
+
+def test_findShortestPath():
+    scenario = {
+        "edges": [
+            "AB5", "BC4", "CD8", "DC8",
+            "DE6", "AD5", "CE2", "EB3",
+            "AE7",
+        ],
+        "queries": [("A", "C"), ("B", "B"), ("A", "E"), ("C", "A")],
+        "expected": [
+            (9, ["A", "B", "C"]),
+            (9, ["B", "C", "E", "B"]),
+            (7, ["A", "E"]),
+            "NO SUCH ROUTE",
+        ],
+    }
+    g = Graph(scenario["edges"])
+    routes = [
+        g.findShortestPath(source, destination)
+        for (source, destination) in scenario["queries"]
+    ]
+    assert routes == scenario["expected"]
+    # the tree of the last origin is kept, no search for the next route
+    assert list(g._treeCache) == [g.nodes["C"]]
+
+
+def test_findShortestPath_after_changes():
+    scenario = {
+        "edges": ["AB5", "AC2", "CB-1", "BD1"],
+        "expected": (2, ["A", "C", "B", "D"]),
+        "changes": [("A", "D", 1)],
+        "expectedAfter": (1, ["A", "D"]),
+    }
+    g = Graph(scenario["edges"])
+    assert g.findShortestPath("A", "D") == scenario["expected"]
+    for source, destination, weight in scenario["changes"]:
+        g.addEdge(source, destination, weight)
+    assert g.findShortestPath("A", "D") == scenario["expectedAfter"]
+
+
+def test_findKShortestPaths():
+    scenario = {
+        "edges": [
+            "AB5", "BC4", "CD8", "DC8",
+            "DE6", "AD5", "CE2", "EB3",
+            "AE7",
+        ],
+        "queries": [("A", "C", 3), ("C", "C", 10), ("C", "A", 2)],
+        "expected": [
+            [
+                (9, ["A", "B", "C"]),
+                (13, ["A", "D", "C"]),
+                (14, ["A", "E", "B", "C"]),
+            ],
+            [
+                (9, ["C", "E", "B", "C"]),
+                (16, ["C", "D", "C"]),
+                (21, ["C", "D", "E", "B", "C"]),
+            ],
+            [],
+        ],
+    }
+    g = Graph(scenario["edges"])
+    routes = [
+        g.findKShortestPaths(source, destination, k)
+        for (source, destination, k) in scenario["queries"]
+    ]
+    assert routes == scenario["expected"]
+
+
+def test_findKShortestPaths_negative_weight():
+    scenario = {
+        "edges": ["AB5", "AC2", "CB-1", "BD1", "AD4"],
+        "expected": [
+            (2, ["A", "C", "B", "D"]),
+            (4, ["A", "D"]),
+            (6, ["A", "B", "D"]),
+        ],
+    }
+    g = Graph(scenario["edges"])
+    assert g.findKShortestPaths("A", "D", 5) == scenario["expected"]
+
+    # a negative cycle that never gets to D changes nothing
+    g = Graph(scenario["edges"] + ["XY-1", "YX-1", "AX1"])
+    assert g.findKShortestPaths("A", "D", 5) == scenario["expected"]
+    g.addEdge("Y", "D", 1)
+    error = g.findKShortestPaths("A", "D", 5)
+    assert isinstance(error, NegativeCycleError)
+    assert set(error.cycle) == {"X", "Y"}
+
+
+def test_findLengthOfShortestPathBetweenTwo_negative_cycle():
+    scenario = {
+        "edges": ["AB1", "BC-3", "CA1", "CD2", "XA1"],
+        "source": "X",
+        "destination": "D",
+        "stations": {"A", "B", "C"},
+    }
+    g = Graph(scenario["edges"])
+    for method in [None, "spfa", "bellman-ford"]:
+        error = g.findLengthOfShortestPathBetweenTwo(
+            scenario["source"], scenario["destination"], method
+        )
+        assert isinstance(error, NegativeCycleError)
+        assert error.startswith("NegativeCycleError")
+        assert set(error.cycle) == scenario["stations"]
+        assert error.cycle[0] == error.cycle[-1]
+        assert g.computeExactPathDistance(error.cycle) < 0
+
+
+def test_findLengthOfShortestPathBetweenTwo_bellman_ford_early_exit():
+    scenario = {
+        "edges": ["AB1", "BC-3", "CD1", "DE1", "EF1", "FG1", "GH1"],
+        "source": "A",
+        "destination": "H",
+        "expected": 3,
+        "passes": 2,  # one to settle the line, one to see nothing moves
+    }
+    stats = []
+    g = Graph(scenario["edges"], onQuery=stats.append)
+    g.KERNELS = g.VECTORIZED = False  # the loop over one edge at a time
+    distance = g.findLengthOfShortestPathBetweenTwo(
+        scenario["source"], scenario["destination"], "bellman-ford"
+    )
+    assert distance == scenario["expected"]
+    assert stats[-1].expanded == scenario["passes"]
+
+
+def test_findLengthOfShortestPathBetweenTwo_vectorized_bellman_ford():
+    pytest.importorskip("numpy")
+    scenario = {
+        "edges": ["AB1", "BC-3", "CD1", "DE1", "EF1", "FG1", "GH1", "HA2"],
+        "source": "A",
+        "expected": {"A": 5, "B": 1, "C": -2, "D": -1, "H": 3},
+        "passes": 8,  # one per edge down the line, one to see it is done
+        "cycle": ["AB1", "BC-3", "CD1", "DB1", "DE4"],
+        "stations": {"B", "C", "D"},
+    }
+    stats = []
+    g = Graph(scenario["edges"], onQuery=stats.append)
+    g.KERNELS = False
+    for destination, expected in scenario["expected"].items():
+        distance = g.findLengthOfShortestPathBetweenTwo(
+            scenario["source"], destination, "bellman-ford"
+        )
+        assert distance == expected
+    assert stats[-1].expanded == scenario["passes"]
+
+    g = Graph(scenario["cycle"])
+    g.KERNELS = False
+    error = g.findLengthOfShortestPathBetweenTwo("A", "E")
+    assert isinstance(error, NegativeCycleError)
+    assert set(error.cycle) == scenario["stations"]
+    assert g.computeExactPathDistance(error.cycle) < 0
+
+
+def test_compiled_kernels_match_python_loops():
+    pytest.importorskip("numba")
+    scenario = {
+        "edges": [
+            "AB5", "BC-4", "CD8", "DC8",
+            "DE-6", "AD5", "CE2", "EB3",
+            "AE7", "BA9",
+        ],
+        "source": "A",
+        "cycle": ["AB1", "BC-3", "CA1"],
+    }
+    g = Graph(scenario["edges"])
+    source = scenario["source"]
+
+    def answers():
+        return [
+            [g.findLengthOfShortestPathBetweenTwo(source, other, method)
+             for other in g.labels
+             for method in ("bellman-ford", "spfa")],
+            [g.countAllUniquePathsWithLimitByBFS(source, other, 9, notation)
+             for other in g.labels
+             for notation in g.LEGAL_NOTATIONS],
+            g.countRoutesFrom(source, 90, "<="),  # past int64, Python ints
+        ]
+
+    assert g.KERNELS
+    compiled = answers()
+    g.KERNELS = False
+    assert answers() == compiled
+
+    g = Graph(scenario["cycle"])
+    for kernels in (True, False):
+        g.KERNELS = kernels
+        for method in ("bellman-ford", "spfa"):
+            error = g.findLengthOfShortestPathBetweenTwo("A", "C", method)
+            assert isinstance(error, NegativeCycleError)
+
+
+def test_reverse_queries():
+    scenario = {
+        "edges": [
+            "AB5", "BC4", "CD8", "DC8",
+            "DE6", "AD5", "CE2", "EB3",
+            "AE7",
+        ],
+        "destination": "C",
+        "stops": {"A": 2, "B": 1, "C": 2, "D": 1, "E": 2},
+        "withinOneStop": {"B": 1, "D": 1},
+        "distances": {"A": 9, "B": 4, "C": 9, "D": 8, "E": 7},
+        "belowNine": {"B": 4, "D": 8, "E": 7},
+    }
+    g = Graph(scenario["edges"])
+    destination = scenario["destination"]
+    assert g.fewestStopsTo(destination) == scenario["stops"]
+    assert g.fewestStopsTo(destination, 1) == scenario["withinOneStop"]
+    assert g.shortestDistancesTo(destination) == scenario["distances"]
+    assert g.shortestDistancesTo(destination, 9) == scenario["belowNine"]
+    assert g.fewestStopsTo("X") == "NO SUCH ROUTE"
+
+
+def test_shortestDistancesTo_negative_weight():
+    scenario = {
+        "edges": ["AB5", "AC2", "CB-1"],
+        "destination": "B",
+        "expected": {"A": 1, "C": -1},
+    }
+    g = Graph(scenario["edges"])
+    assert g.shortestDistancesTo(scenario["destination"]) == \
+        scenario["expected"]
+
+
+def test_shortestDistancesTo_negative_cycle_elsewhere():
+    scenario = {
+        "edges": ["AB5", "BC-4", "XY-1", "YX-1", "XC1"],
+        "expected": {"A": 1, "B": -4},
+        "stations": {"X", "Y"},
+    }
+    g = Graph(scenario["edges"])
+    assert g.shortestDistancesTo("B") == {"A": 5}
+    error = g.shortestDistancesTo("C")  # X and Y go round before C
+    assert isinstance(error, NegativeCycleError)
+    assert set(error.cycle) == scenario["stations"]
+    assert g.computeExactPathDistance(error.cycle) < 0
+    g.removeEdge("X", "C")
+    assert g.shortestDistancesTo("C") == scenario["expected"]
+
+
+def test_shortestDistancesFrom():
+    scenario = {
+        "edges": [
+            "AB5", "BC4", "CD8", "DC8",
+            "DE6", "AD5", "CE2", "EB3",
+            "AE7",
+        ],
+        "source": "B",
+        "targets": ["C", "B", "X"],
+        "expected": {"A": math.inf, "B": 9, "C": 4, "D": 12, "E": 6},
+        "expectedTargets": {"C": 4, "B": 9, "X": "NO SUCH ROUTE"},
+    }
+    g = Graph(scenario["edges"])
+    assert g.shortestDistancesFrom(scenario["source"]) == scenario["expected"]
+    assert g.shortestDistancesFrom(
+        scenario["source"], scenario["targets"]
+    ) == scenario["expectedTargets"]
+
+
 # Assignment 4
 """ #10 The number of different routes from C to C with a distance of less than
 30
@@ -540,3 +1144,637 @@ def test_count_all_unique_paths_below_weight2():
         scenario["distance_cannot_exceed"],
     )
     assert count == scenario["expected"]
+
+
+def test_count_all_unique_paths_below_weight_large_budget():
+    scenario = {
+        "edges": [
+            "AB5", "BC4", "CD8", "DC8",
+            "DE6", "AD5", "CE2", "EB3",
+            "AE7",
+        ],
+        "source": "C",
+        "destination": "C",
+        "distance_cannot_exceed": 300,
+        "expected": 8103663531,
+    }
+    g = Graph(scenario["edges"])
+    count = g.countAllUniquePathsBelowWeight(
+        scenario["source"],
+        scenario["destination"],
+        scenario["distance_cannot_exceed"],
+    )
+    assert count == scenario["expected"]
+
+
+def test_count_all_unique_paths_below_weight_zero_weight_cycle():
+    scenario = {
+        "edges": ["AB0", "BA0", "AC1"],
+        "source": "A",
+        "destination": "C",
+        "distance_cannot_exceed": 5,
+        "expected": math.inf,  # go around A-B-A as often as you like
+    }
+    g = Graph(scenario["edges"])
+    count = g.countAllUniquePathsBelowWeight(
+        scenario["source"],
+        scenario["destination"],
+        scenario["distance_cannot_exceed"],
+    )
+    assert count == scenario["expected"]
+
+
+def test_count_all_unique_paths_below_weight_negative_weight():
+    scenario = {
+        # over budget at B, back under it at C
+        "edges": ["AB5", "BC-4", "CA2"],
+        "source": "A",
+        "destination": "C",
+        "weight": 4,
+        "expected": 1,
+    }
+    g = Graph(scenario["edges"])
+    count = g.countAllUniquePathsBelowWeight(
+        scenario["source"], scenario["destination"], scenario["weight"]
+    )
+    assert count == scenario["expected"]
+
+
+def test_count_all_unique_paths_below_weight_negative_cycle_elsewhere():
+    scenario = [
+        # the cycle is out of reach from A
+        {"edges": ["AB5", "BC-4", "XY-1", "YX-1"], "weight": 2, "expected": 1},
+        # A reaches the cycle, but C is out of reach from it
+        {"edges": ["AC1", "AX1", "XY-1", "YX-1"], "weight": 5, "expected": 1},
+        # A, the cycle, C in a row, routes as light as you like
+        {"edges": ["AX1", "XY-1", "YX-1", "XC1"], "weight": 5,
+         "expected": math.inf},
+    ]
+    for case in scenario:
+        g = Graph(case["edges"])
+        count = g.countAllUniquePathsBelowWeight("A", "C", case["weight"])
+        assert count == case["expected"]
+
+
+"""Streaming routes instead of counting them
+"""
+
+
+def test_iterRoutesBelowWeight():
+    scenario = {  # 10
+        "edges": [
+            "AB5", "BC4", "CD8", "DC8",
+            "DE6", "AD5", "CE2", "EB3",
+            "AE7",
+        ],
+        "source": "C",
+        "destination": "C",
+        "distance_cannot_exceed": 30,
+        "expected": [
+            "CDC", "CDCEBC", "CDEBC", "CEBC",
+            "CEBCDC", "CEBCEBC", "CEBCEBCEBC",
+        ],
+    }
+    g = Graph(scenario["edges"])
+    routes = g.iterRoutesBelowWeight(
+        scenario["source"],
+        scenario["destination"],
+        scenario["distance_cannot_exceed"],
+    )
+    assert sorted("".join(route) for route in routes) == scenario["expected"]
+
+
+def test_iterRoutesBelowWeight_cycles():
+    scenario = {
+        # X and Y go round for less and less, but C is not past them
+        "elsewhere": ["AC1", "AX1", "XY-1", "YX-1"],
+        # the same cycle on the way to C
+        "between": ["AX1", "XY-1", "YX-1", "XC1"],
+        # A and B go round for free before C
+        "zero": ["AB0", "BA0", "AC1"],
+    }
+    g = Graph(scenario["elsewhere"])
+    routes = g.iterRoutesBelowWeight("A", "C", 5, maxResults=3)
+    assert list(routes) == [["A", "C"]]
+
+    g = Graph(scenario["between"])
+    with pytest.raises(ValueError) as error:
+        for route in g.iterRoutesBelowWeight("A", "C", 5):
+            pass
+    assert isinstance(error.value.args[0], NegativeCycleError)
+    assert set(error.value.args[0].cycle) == {"X", "Y"}
+
+    # infinitely many, they still come out one after the other
+    g = Graph(scenario["zero"])
+    routes = g.iterRoutesBelowWeight("A", "C", 3)
+    assert ["A", "C"] in routes
+
+
+def test_iterRoutesWithLimit_max_results():
+    scenario = {  # 7
+        "edges": [
+            "AB5", "BC4", "CD8", "DC8",
+            "DE6", "AD5", "CE2", "EB3",
+            "AE7",
+        ],
+        "source": "A",
+        "destination": "C",
+        "notation": "==",
+        "limit": 4,
+        "max_results": 2,
+        "expected": [
+            ["A", "B", "C", "D", "C"],
+            ["A", "D", "C", "D", "C"],
+        ],
+    }
+    g = Graph(scenario["edges"])
+    routes = g.iterRoutesWithLimit(
+        scenario["source"],
+        scenario["destination"],
+        scenario["limit"],
+        scenario["notation"],
+        maxResults=scenario["max_results"],
+    )
+    assert list(routes) == scenario["expected"]
+
+
+def test_iterRoutesWithLimit_invalid_notation():
+    scenario = {
+        "edges": ["AB5", "BC4"],
+        "notation": ">=",
+    }
+    g = Graph(scenario["edges"])
+    with pytest.raises(ValueError, match="NotationError"):
+        for route in g.iterRoutesWithLimit("A", "C", 3, scenario["notation"]):
+            pass
+
+
+def test_iterRoutesWithLimit_deadline_passed():
+    scenario = {
+        "edges": [
+            "AB5", "BC4", "CD8", "DC8",
+            "DE6", "AD5", "CE2", "EB3",
+            "AE7",
+        ],
+        "source": "C",
+        "destination": "C",
+        "notation": "<",
+        "limit": 30,
+        "expected": [],
+    }
+    g = Graph(scenario["edges"])
+    routes = g.iterRoutesWithLimit(
+        scenario["source"],
+        scenario["destination"],
+        scenario["limit"],
+        scenario["notation"],
+        deadline=time.monotonic(),
+    )
+    assert list(routes) == scenario["expected"]
+
+
+"""Batches: many origins at once, sharded over worker processes
+"""
+
+
+def test_batchShortest():
+    scenario = {
+        "edges": [
+            "AB5", "BC4", "CD8", "DC8",
+            "DE6", "AD5", "CE2", "EB3",
+            "AE7",
+        ],
+        "sources": ["A", "B", "X"],
+        "destinations": ["C", "B"],
+        "expected": [{"C": 9, "B": 5}, {"C": 4, "B": 9}, "NO SUCH ROUTE"],
+    }
+    g = Graph(scenario["edges"])
+    for workers in [1, 2]:
+        rows = g.batchShortest(
+            scenario["sources"], scenario["destinations"], workers=workers
+        )
+        assert rows == scenario["expected"]
+
+
+def test_batchCountRoutes():
+    scenario = {  # 6, 7
+        "edges": [
+            "AB5", "BC4", "CD8", "DC8",
+            "DE6", "AD5", "CE2", "EB3",
+            "AE7",
+        ],
+        "pairs": [("C", "C"), ("A", "C"), ("C", "X")],
+        "expected": {"<=": [2, 3, 0], "==": [2, 3, 0]},
+        "limits": {"<=": 3, "==": 4},
+    }
+    g = Graph(scenario["edges"])
+    for notation, expected in scenario["expected"].items():
+        counts = g.batchCountRoutes(
+            scenario["pairs"] * 3,
+            scenario["limits"][notation],
+            notation,
+            workers=2,
+        )
+        assert counts == expected * 3
+
+
+"""Async service: identical queries in flight share one computation
+"""
+
+
+def test_asyncGraph_coalesces_queries_per_origin():
+    scenario = {
+        "edges": [
+            "AB5", "BC4", "CD8", "DC8",
+            "DE6", "AD5", "CE2", "EB3",
+            "AE7",
+        ],
+        "queries": [("A", "C"), ("A", "E"), ("A", "A"), ("A", "C")] * 5,
+        "expected": [9, 7, math.inf, 9] * 5,
+        "searches": 1,
+    }
+    g = Graph(scenario["edges"])
+    searches = []
+    distancesFrom = g._distancesFrom
+
+    def counted(source):
+        searches.append(source)
+        return distancesFrom(source)
+
+    g._distancesFrom = counted
+
+    async def serve():
+        async with AsyncGraph(g) as service:
+            return await asyncio.gather(*(
+                service.findLengthOfShortestPathBetweenTwo(*query)
+                for query in scenario["queries"]
+            ))
+
+    assert asyncio.run(serve()) == scenario["expected"]
+    assert len(searches) == scenario["searches"]
+
+
+def test_asyncGraph_changes_are_seen():
+    scenario = {
+        "edges": ["AB5", "BC4", "AC20"],
+        "change": ("A", "C", 3),
+        "expected": [9, 9, 3],
+    }
+    g = Graph(scenario["edges"])
+
+    async def serve():
+        async with AsyncGraph(g) as service:
+            before = [
+                asyncio.ensure_future(
+                    service.findLengthOfShortestPathBetweenTwo("A", "C")
+                )
+                for _ in range(2)
+            ]
+            await asyncio.sleep(0)  # both queued before the change
+            await service.updateWeight(*scenario["change"])
+            after = await service.findLengthOfShortestPathBetweenTwo("A", "C")
+            return [await future for future in before] + [after]
+
+    assert asyncio.run(serve()) == scenario["expected"]
+
+
+"""Live changes: edges come and go on an existing graph, cached
+distances follow
+"""
+
+
+def test_addEdge_repairs_cached_distances():
+    scenario = {
+        "edges": [
+            "AB5", "BC4", "CD8", "DC8",
+            "DE6", "AD5", "CE2", "EB3",
+            "AE7",
+        ],
+        "add": ("A", "C", 3),
+        "queries": [("A", "C"), ("A", "E"), ("B", "B")],
+        "expected": [3, 5, 9],
+    }
+    g = Graph(scenario["edges"], cacheSize=8)
+    g.findLengthOfShortestPathBetweenTwo("A", "C")  # fill the cache
+    g.addEdge(*scenario["add"])
+
+    distances = [
+        g.findLengthOfShortestPathBetweenTwo(source, destination)
+        for (source, destination) in scenario["queries"]
+    ]
+    assert distances == scenario["expected"]
+    assert g.computeExactPathDistance("AC") == 3
+
+
+def test_removeEdge_and_updateWeight_all_pairs():
+    scenario = {
+        "edges": [
+            "AB5", "BC4", "CD8", "DC8",
+            "DE6", "AD5", "CE2", "EB3",
+            "AE7",
+        ],
+        "queries": [("A", "C"), ("B", "B"), ("C", "B")],
+        "expected": [13, 10, 6],
+    }
+    g = Graph(scenario["edges"])
+    g.precomputeAllPairs("dijkstra")
+    g.removeEdge("B", "C")
+    g.addEdge("B", "C", 4)
+    g.updateWeight("E", "B", 4)  # B-C-E-B is now 10
+    g.removeEdge("A", "B")  # A-B-C is gone, A-D-C is 13
+
+    distances = [
+        g.findLengthOfShortestPathBetweenTwo(source, destination)
+        for (source, destination) in scenario["queries"]
+    ]
+    assert distances == scenario["expected"]
+    assert g.removeEdge("A", "B") == "NO SUCH ROUTE"
+
+
+def test_addEdge_new_station():
+    scenario = {
+        "edges": ["AB1", "BC2"],
+        "add": [("C", "Z", 4), ("Z", "A", 1)],
+        "source": "A",
+        "destination": "Z",
+        "expected": 7,
+    }
+    g = Graph(scenario["edges"], cacheSize=8)
+    g.findLengthOfShortestPathBetweenTwo("A", "C")
+    for edge in scenario["add"]:
+        g.addEdge(*edge)
+
+    distance = g.findLengthOfShortestPathBetweenTwo(
+        scenario["source"],
+        scenario["destination"],
+    )
+    assert distance == scenario["expected"]
+    assert g.findLengthOfShortestPathBetweenTwo("A", "A") == 8
+
+
+def test_addEdge_self_loop():
+    scenario = {
+        "edges": ["AB1", "BA7"],
+        # (change, shortest round trip from A) in order, like the
+        # constructor a self-loop is an edge like any other
+        "changes": [
+            (("addEdge", "A", "A", 5), 5),
+            (("updateWeight", "A", "A", 9), 8),
+            (("removeEdge", "A", "A"), 8),
+        ],
+    }
+    g = Graph(scenario["edges"], cacheSize=8)
+    assert g.findLengthOfShortestPathBetweenTwo("A", "A") == 8
+    for change, expected in scenario["changes"]:
+        assert getattr(g, change[0])(*change[1:]) is None
+        assert g.findLengthOfShortestPathBetweenTwo("A", "A") == expected
+
+
+"""Graph representation: labels are interned to dense ids and edges
+are laid out as compressed sparse rows sorted by target
+"""
+
+
+def test_graph_compressed_sparse_rows():
+    scenario = {
+        "edges": ["BC4", "AC3", "AB5"],
+        "labels": ["B", "C", "A"],
+        "offsets": [0, 1, 1, 3],
+        "targets": [1, 0, 1],
+        "weights": [4, 5, 3],
+    }
+    g = Graph(scenario["edges"])
+
+    assert g.labels == scenario["labels"]
+    assert g.nodes == {"B": 0, "C": 1, "A": 2}
+    assert list(g.offsets) == scenario["offsets"]
+    assert list(g.targets) == scenario["targets"]
+    assert list(g.weights) == scenario["weights"]
+    # C is reached from B (4) and from A (3)
+    assert list(g.reverseOffsets) == [0, 1, 3, 3]
+    assert list(g.reverseTargets) == [2, 0, 2]
+    assert list(g.reverseWeights) == [5, 4, 3]
+
+
+def test_graph_multi_character_labels():
+    scenario = {
+        "lines": [
+            "# Kiwiland, long names",
+            "Kaitaia,Auckland,320",
+            "Auckland, Wellington, 640",
+            "",
+            "Wellington-Invercargill:950",
+            "Kaitaia-Wellington:1200",
+        ],
+        "path": ["Kaitaia", "Auckland", "Wellington", "Invercargill"],
+        "expected": 1910,
+    }
+    g = Graph.fromIterable(scenario["lines"])
+
+    assert len(g.labels) == 4
+    assert g.computeExactPathDistance(scenario["path"]) == scenario["expected"]
+    assert g.computeExactPathDistance("Kaitaia-Wellington") == 1200
+    assert g.findLengthOfShortestPathBetweenTwo(
+        "Kaitaia", "Invercargill"
+    ) == 1910
+
+
+def test_graph_fromFile(tmp_path):
+    scenario = {
+        "edges": ["AB5", "BC4", "CD8", "DC8", "DE6", "AD5", "CE2", "EB3"],
+        "path": "A-D-C",
+        "expected": 13,
+    }
+    path = tmp_path / "kiwiland.txt"
+    path.write_text("\n".join(scenario["edges"]) + "\n")
+    g = Graph.fromFile(str(path))
+
+    assert g.computeExactPathDistance(scenario["path"]) == scenario["expected"]
+    assert g.computeExactPathDistance("ADC") == scenario["expected"]
+
+
+def test_graph_save_and_load(tmp_path):
+    scenario = {
+        "edges": ["Kaitaia,Auckland,320", "Auckland,Wellington,640"],
+        "queries": [("Kaitaia", "Wellington"), ("Wellington", "Auckland")],
+        "expected": [960, math.inf],
+    }
+    path = str(tmp_path / "network.graph")
+    Graph(scenario["edges"]).save(path)
+
+    for mmap in [True, False]:
+        g = Graph.load(path, mmap=mmap)
+        assert g.labels == ["Kaitaia", "Auckland", "Wellington"]
+        distances = [
+            g.findLengthOfShortestPathBetweenTwo(source, destination)
+            for (source, destination) in scenario["queries"]
+        ]
+        assert distances == scenario["expected"]
+
+
+def test_graph_load_copies_on_write(tmp_path):
+    scenario = {
+        "edges": ["AB5", "BC4", "AC20"],
+        "change": ("A", "C", 3),
+        "expected": 9,
+        "expectedAfter": 3,
+    }
+    path = str(tmp_path / "network.graph")
+    Graph(scenario["edges"]).save(path)
+
+    g = Graph.load(path)
+    assert isinstance(g.targets, memoryview)
+    g.updateWeight(*scenario["change"])
+    assert g.findLengthOfShortestPathBetweenTwo("A", "C") == \
+        scenario["expectedAfter"]
+    # the file, and every process mapping it, still has the old weight
+    assert Graph.load(path).findLengthOfShortestPathBetweenTwo("A", "C") == \
+        scenario["expected"]
+
+
+def test_graph_load_not_a_snapshot(tmp_path):
+    path = tmp_path / "kiwiland.txt"
+    path.write_text("AB5\n")
+    with pytest.raises(ValueError):
+        Graph.load(str(path))
+
+
+def test_batchShortest_snapshot_replaced_or_removed(tmp_path):
+    scenario = {
+        "edges": ["AB5", "BC4", "AC20"],
+        "newer": ["AC2"],
+        "expected": [{"C": 9}, {"C": 9}],
+    }
+    path = str(tmp_path / "network.graph")
+    Graph(scenario["edges"]).save(path)
+    loaded = Graph.load(path)
+    saved = Graph(scenario["edges"])
+    saved.save(str(tmp_path / "saved.graph"))
+
+    # unchanged, workers map it
+    assert loaded._sharedSnapshot() == loaded._snapshot
+    # a newer snapshot renamed over the old one, the old one still mapped
+    Graph(scenario["newer"]).save(path)
+    os.remove(str(tmp_path / "saved.graph"))
+    for g in [loaded, saved]:
+        rows = g.batchShortest(["A", "A"], ["C"], workers=2)
+        assert rows == scenario["expected"]
+
+
+def test_graph_hierarchy_saved_and_dropped(tmp_path):
+    scenario = {
+        "edges": [
+            "AB5", "BC4", "CD8", "DC8",
+            "DE6", "AD5", "CE2", "EB3",
+            "AE7",
+        ],
+        "queries": [("A", "C"), ("D", "B"), ("E", "D")],
+        "expected": [9, 9, 15],
+        "change": ("A", "C", 3),
+    }
+    path = str(tmp_path / "kiwiland.graph")
+    g = Graph(scenario["edges"])
+    assert g.precomputeHierarchy() is None
+    g.save(path)
+
+    g = Graph.load(path)
+    assert g._hierarchy is not None
+    distances = [
+        g.findLengthOfShortestPathBetweenTwo(source, destination)
+        for (source, destination) in scenario["queries"]
+    ]
+    assert distances == scenario["expected"]
+    # shortcuts are built on the old weights
+    g.addEdge(*scenario["change"])
+    assert g._hierarchy is None
+    assert g.findLengthOfShortestPathBetweenTwo("A", "C") == 3
+
+
+def test_graph_malformed_edge():
+    with pytest.raises(ValueError):
+        Graph(["Kaitaia,Auckland"])
+
+
+"""Instrumentation: queries report what they did instead of printing
+"""
+
+
+def test_onQuery_stats():
+    scenario = {  # 8
+        "edges": [
+            "AB5", "BC4", "CD8", "DC8",
+            "DE6", "AD5", "CE2", "EB3",
+            "AE7",
+        ],
+        "source": "A",
+        "destination": "C",
+        "expected": 9,
+    }
+    seen = []
+    g = Graph(scenario["edges"], onQuery=seen.append)
+    distance = g.findLengthOfShortestPathBetweenTwo(
+        scenario["source"],
+        scenario["destination"],
+    )
+
+    assert distance == scenario["expected"]
+    assert len(seen) == 1
+    stats = seen[0]
+    assert stats.query == "findLengthOfShortestPathBetweenTwo"
+    assert stats.expanded >= 2  # A then B before C is settled
+    assert stats.relaxations >= stats.pushes > 0
+    assert stats.peakQueue > 0
+    assert stats.seconds > 0
+
+
+def test_debug_logging_and_no_print(capsys, caplog):
+    scenario = {
+        "edges": ["AB5", "AC2", "CB-1"],
+        "source": "A",
+        "destination": "B",
+        "expected": 1,
+    }
+    g = Graph(scenario["edges"])
+    with caplog.at_level(logging.DEBUG, logger="pathfinder"):
+        distance = g.findLengthOfShortestPathBetweenTwo(
+            scenario["source"],
+            scenario["destination"],
+        )
+
+    assert distance == scenario["expected"]
+    assert capsys.readouterr().out == ""
+    assert "findLengthOfShortestPathBetweenTwo" in caplog.text
+    assert "relaxations" in caplog.text
+
+
+def test_findAllPathsWithLimit_memory_stats():
+    scenario = {
+        "edges": [
+            "AB5", "BC4", "CD8", "DC8",
+            "DE6", "AD5", "CE2", "EB3",
+            "AE7",
+        ],
+        "source": "C",
+        "destination": "C",
+        "limit": 10,
+        "notation": "<=",
+    }
+    seen = []
+    g = Graph(scenario["edges"], onQuery=seen.append)
+    paths = g.findAllPathsWithLimit(
+        scenario["source"],
+        scenario["destination"],
+        scenario["limit"],
+        scenario["notation"],
+    )
+
+    stats = seen[-1]
+    assert len(paths) == g.countAllUniquePathsWithLimitByBFS(
+        scenario["source"],
+        scenario["destination"],
+        scenario["limit"],
+        scenario["notation"],
+    )
+    assert len({tuple(path) for path in paths}) == len(paths)
+    # three machine integers at most per walk prefix, nothing copied
+    assert 0 < stats.peakBytes <= 3 * 8 * (stats.pushes + 1)